@@ -1,5 +1,5 @@
 """对话系统核心包"""
-from .core import Content, ConvGraph
+from .core import Content, ConvState, ConvGraph
 from .llm import create_llm
 
 __all__ = [
@@ -18,4 +18,6 @@ __all__ = [
     'History',
     'ConversationGraph',
     'HistoryManager',
+    'ConvState',
+    'ConvGraph',
 ]
@@ -6,7 +6,8 @@
 """
 
 import asyncio
-from typing import Dict, Optional, Any
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional, Any
 from .modules import ConversationState, Message, Content
 from .manager import HistoryManager
 from ..llm import create_llm, BaseLLM
@@ -22,6 +23,7 @@ class ConversationGraph:
         llm：语言模型类型（'mock'、'ollama'、'openai'）
         max_concurrent: 最大并发数
         history_save_dir: 对话历史保存目录
+        history_save_format: 对话历史保存格式（json|msgpack）
     属性:
         llm: 语言模型实例
         history_manager: 对话管理器
@@ -33,12 +35,20 @@ class ConversationGraph:
         llm: str | BaseLLM | None = None,
         max_concurrent: int = 5,
         history_save_dir: str = None,
+        history_save_format: str = None,
     ):
         self.llm = llm if isinstance(llm, BaseLLM) else create_llm(llm)
-        self.history_manager = HistoryManager(history_save_dir=history_save_dir)
+        self.history_manager = HistoryManager(
+            history_save_dir=history_save_dir, save_format=history_save_format
+        )
         self.semaphore = asyncio.Semaphore(max_concurrent)
         self.logger = get_logger("graph")
 
+    def set_max_concurrent(self, max_concurrent: int) -> None:
+        """调整最大并发数，复用已有的LLM客户端与对话存储。
+        只替换信号量，应在没有进行中的 chat() 时调用。"""
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
     # HSC: check whether this is needed
     # def generate_conv_id(self) -> str:
     #     return new_id()
@@ -79,16 +89,15 @@ class ConversationGraph:
         保存用户输入和AI回复到历史。
         参数 / 返回: state: ConversationState
         """
+        # 同一轮的消息共用一个时间戳
+        now = datetime.now()
+        to_save = []
         if state.current_input:
-            self.history_manager.save_msg(
-                conv_id=state.conv_id, 
-                msg=Message(role="user", content=state.current_input)
-            )
+            to_save.append(Message(role="user", content=state.current_input, timestamp=now))
+        if state.response:
+            to_save.append(Message(role="assistant", content=state.response, timestamp=now))
+        self.history_manager.save_msgs(conv_id=state.conv_id, msgs=to_save)
         if state.response:
-            self.history_manager.save_msg(
-                conv_id=state.conv_id,
-                msg=Message(role="assistant", content=state.response)
-            )
             self.logger.debug(f"[Save history] | "
                               f"conv_id = {shortcut_id(state.conv_id)} | "
                               f"messages = {self.history_manager.get_length(state.conv_id)}")
@@ -101,6 +110,7 @@ class ConversationGraph:
         system_prompt: Optional[str] = None,
         content: Optional[Content] = None,
         return_history: bool = False,
+        include_preview: bool = False,
     ) -> Dict[str, Any]:
         """
         主聊天接口，支持结构化内容。
@@ -108,13 +118,15 @@ class ConversationGraph:
             conv_id: 对话ID
             system_prompt: 系统提示
             content: 结构化输入
+            return_history: 是否返回完整历史 JSON
+            include_preview: 是否返回输入预览文本（按需生成）
         返回: dict
         """
         # # HSC: will remove
         # assert conv_id, "必须提供 conv_id"
         async with self.semaphore:  # 控制并发
             state = ConversationState(
-                conv_id=conv_id or ConversationState().conv_id,
+                conv_id=conv_id or new_id(),
                 system_prompt=system_prompt,
                 current_input=content
             )
@@ -125,26 +137,74 @@ class ConversationGraph:
             state = await self._generate_response(state)
             state = await self._save_history(state)
 
-            self.logger.info(f"[End conversation] | "
-                             f"conv_id = {shortcut_id(state.conv_id)} | "
-                             f"messages = {self.history_manager.get_length(state.conv_id)}")
+        # 以下只做结果组装/序列化，与LLM并发无关，放在信号量之外，避免占用并发名额
+        message_count = self.history_manager.get_length(state.conv_id)
+        self.logger.info(f"[End conversation] | "
+                         f"conv_id = {shortcut_id(state.conv_id)} | "
+                         f"messages = {message_count}")
 
-            result = {
-                "conv_id": state.conv_id,
-                "response": state.response,
-                "message_count": self.history_manager.get_length(state.conv_id),
-            }
+        result = {
+            "conv_id": state.conv_id,
+            "response": state.response,
+            "message_count": message_count,
+        }
 
-            if return_history:
-                result["history"] = self.history_manager.to_json(state.conv_id)
-            return result
+        if include_preview and state.current_input:
+            result["input_preview"] = state.current_input.to_display_text()
+        if return_history:
+            result["history"] = self.history_manager.to_json(state.conv_id)
+        return result
+
+    async def chat_stream(
+        self,
+        conv_id: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        content: Optional[Content] = None,
+    ) -> AsyncIterator[str]:
+        """
+        流式聊天接口：逐段产出回复文本，首段到达即可展示；生成结束后与 chat() 相同地写入历史。
+        参数同 chat()；未指定 conv_id 时新建对话，需要续聊时应自行传入 conv_id（可用 new_id() 生成）。
+        不支持流式的LLM一次性产出完整回复。迭代期间占用一个并发名额，中途停止迭代则本轮不写入历史。
+        """
+        async with self.semaphore:  # 控制并发
+            state = ConversationState(
+                conv_id=conv_id or new_id(),
+                system_prompt=system_prompt,
+                current_input=content
+            )
+
+            self.logger.info(f"[Start conversation stream] | conv_id = {shortcut_id(state.conv_id)}")
+            state = await self._prepare_messages(state)
+            if state.current_input:
+                parts = []
+                async for chunk in self.llm.stream_response(
+                    messages=self.history_manager.get_msgs(state.conv_id),
+                    current_input=state.current_input
+                ):
+                    parts.append(chunk)
+                    yield chunk
+                state.response = "".join(parts)
+            state = await self._save_history(state)
+
+        self.logger.info(f"[End conversation stream] | "
+                         f"conv_id = {shortcut_id(state.conv_id)} | "
+                         f"messages = {self.history_manager.get_length(state.conv_id)}")
 
     async def end(self, conv_id: str, save: bool) -> str:
-        """保存对话到文件并清理内存。"""
+        """保存对话到文件并清理内存（包括LLM侧按该对话缓存的转换结果）。"""
         file_path = None
         if save:
             file_path = await self.history_manager.save_conversation_to_file(conv_id)
-            self.logger.info(f"[Conversation saved] | file = {file_path}")
+        self.llm.release_history(self.history_manager.get_msgs(conv_id))
         self.history_manager.cleanup_memory(conv_id)
-        self.logger.debug(f"[Cleanup memory] | conv_id = {shortcut_id(conv_id)}")
-        return file_path
\ No newline at end of file
+        return file_path
+
+    async def aclose(self) -> None:
+        """释放LLM的连接资源（HTTP会话/客户端），应在事件循环结束前调用；之后再次使用时按需重建"""
+        await self.llm.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
\ No newline at end of file
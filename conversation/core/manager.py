@@ -1,12 +1,22 @@
+import asyncio
 import os
 import aiofiles
+import aiofiles.os
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, List
 from datetime import datetime
 from .modules import Message, History
 from ..utils.logging import get_logger, log_exception, warn_once
 from ..utils.id_utils import shortcut_id
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 持久化格式 → 文件后缀；json 便于阅读与导出，msgpack 体积更小、解析更快
+_SAVE_SUFFIXES = {"json": ".json", "msgpack": ".msgpack"}
+
 
 class HistoryManager:
     """
@@ -17,18 +27,26 @@ class HistoryManager:
     
     参数:
         history_save_dir: 保存目录
+        save_format: 持久化格式 json|msgpack，默认读取 HISTORY_SAVE_FORMAT，未设置时为 json
     属性:
         _map: 内存对话存储 (Dict[str, History])
         history_save_dir: 文件保存目录 (Path)
+        save_format: 持久化格式
         logger: 日志记录器
     """
 
-    def __init__(self, history_save_dir: str = None):
+    def __init__(self, history_save_dir: str = None, save_format: str = None):
         self.logger = get_logger("manager")
         self._map: Dict[str, History] = {}
         
         self.history_save_dir = history_save_dir or os.getenv("HISTORY_SAVE_DIR", "./log/conv_log/draft")
         self._resolve_history_save_dir()
+        
+        self.save_format = (save_format or os.getenv("HISTORY_SAVE_FORMAT", "json")).lower()
+        if self.save_format not in _SAVE_SUFFIXES:
+            raise ValueError(f"不支持的保存格式: {self.save_format}，应为 {list(_SAVE_SUFFIXES)} 之一")
+        if self.save_format == "msgpack" and msgpack is None:
+            raise ImportError("请安装msgpack包: pip install msgpack")
     
     def _resolve_history_save_dir(self):
         self.history_save_dir = Path(self.history_save_dir)
@@ -40,49 +58,86 @@ class HistoryManager:
         return conv_id in self._map
     
     def get_msgs(self, conv_id: str) -> List[Message]:
-        if self.exists(conv_id):
-            return self._map[conv_id].messages
-        return []
+        history = self._map.get(conv_id)
+        return history.messages if history is not None else []
 
     def get_length(self, conv_id: str) -> int:
         """获取对话的消息数量。如果对话不存在，返回 -1 """
-        if self.exists(conv_id):
-            return len(self.get_msgs(conv_id))
-        return -1
+        history = self._map.get(conv_id)
+        return len(history.messages) if history is not None else -1
 
     def to_json(self, conv_id: str) -> str:
         """将对话转换为 JSON 字符串。如果对话不存在，返回空字符串。"""
-        if self.exists(conv_id):
-            return self._map[conv_id].model_dump_json(indent=2, exclude_none=True)
-        return ""
+        history = self._map.get(conv_id)
+        return history.model_dump_json(indent=2, exclude_none=True) if history is not None else ""
+
+    def _get_or_create(self, conv_id: str, now: datetime) -> History:
+        """获取内存中的对话，不存在则以 now 为创建时间新建。"""
+        history = self._map.get(conv_id)
+        if history is None:
+            history = self._map[conv_id] = History(conv_id=conv_id, created_at=now, updated_at=now)
+            self.logger.debug(f"[Create new conversation] | conv_id = {shortcut_id(conv_id)}")
+        return history
 
     @log_exception
     def save_msg(self, conv_id: str, msg: Message) -> None:
-        """保存单条消息到内存。"""
-        if conv_id not in self._map:
-            self._map[conv_id] = History(conv_id=conv_id)
-            self._map[conv_id].created_at = datetime.now()
-            self.logger.debug(f"[Create new conversation] | conv_id = {shortcut_id(conv_id)}")
-        self._map[conv_id].messages.append(msg)
-        self._map[conv_id].updated_at = datetime.now()
+        """保存单条消息到内存。更新时间取消息自身的时间戳，不再单独取当前时间。"""
+        now = msg.timestamp
+        history = self._get_or_create(conv_id, now)
+        history.messages.append(msg)
+        history.updated_at = now
         self.logger.debug(f"[Save message] | conv_id = {shortcut_id(conv_id)} | role = {msg.role}")
 
+    @log_exception
+    def save_msgs(self, conv_id: str, msgs: Iterable[Message]) -> None:
+        """批量保存多条消息到内存，只做一次字典查找。更新时间取最后一条消息的时间戳。"""
+        msgs = list(msgs)
+        if not msgs:
+            return
+        now = msgs[-1].timestamp
+        history = self._get_or_create(conv_id, now)
+        history.messages.extend(msgs)
+        history.updated_at = now
+        self.logger.debug(f"[Save messages] | conv_id = {shortcut_id(conv_id)} | "
+                          f"roles = {[m.role for m in msgs]}")
+
     @log_exception
     async def save_conversation_to_file(self, conv_id: str) -> str:
-        """持久化对话到 JSON 文件。"""
-        if not self.exists(conv_id):
+        """持久化对话到文件（格式见 save_format）。先写临时文件并 fsync，再原子替换，避免中途崩溃留下半截文件。
+        序列化结果以二进制一次写入；fsync/replace 均不阻塞事件循环。"""
+        history = self._map.get(conv_id)
+        if history is None:
             raise ValueError(f"No conversation found with ID: {conv_id}")
         
-        filepath = self.history_save_dir / f"{conv_id}.json"
-        async with aiofiles.open(filepath, 'w', encoding='utf-8') as f:
-            data = self._map[conv_id].model_dump_json(indent=2, exclude_none=True)
+        filepath = self.history_save_dir / f"{conv_id}{_SAVE_SUFFIXES[self.save_format]}"
+        tmp_path = filepath.with_suffix(filepath.suffix + ".tmp")
+        if self.save_format == "msgpack":
+            # 时间等字段先转为 JSON 兼容的值（ISO 字符串），与 JSON 文件内容一致
+            data = msgpack.packb(history.model_dump(mode="json", exclude_none=True), use_bin_type=True)
+        else:
+            data = history.model_dump_json(indent=2, exclude_none=True).encode("utf-8")
+        async with aiofiles.open(tmp_path, 'wb') as f:
             await f.write(data)
+            await f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+        await aiofiles.os.replace(tmp_path, filepath)
 
-        self.logger.info(f"[Conversation saved] | conv_id = {shortcut_id(conv_id)} | messages = {self.get_length(conv_id)}")
+        self.logger.info(f"[Conversation saved] | conv_id = {shortcut_id(conv_id)} | "
+                         f"messages = {len(history.messages)} | file = {filepath}")
         return str(filepath)
 
+    @staticmethod
+    def load_conversation_from_file(filepath: str) -> History:
+        """读取 save_conversation_to_file 写出的文件，按后缀区分 JSON / msgpack。"""
+        path = Path(filepath)
+        data = path.read_bytes()
+        if path.suffix == ".msgpack":
+            if msgpack is None:
+                raise ImportError("请安装msgpack包: pip install msgpack")
+            return History.model_validate(msgpack.unpackb(data, raw=False))
+        return History.model_validate_json(data)
+
     def cleanup_memory(self, conv_id: str) -> None:
         """清理内存中的对话。"""
-        if conv_id in self._map:
-            del self._map[conv_id]
+        if self._map.pop(conv_id, None) is not None:
             self.logger.debug(f"[Cleanup memory] | conv_id = {shortcut_id(conv_id)}")
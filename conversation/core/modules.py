@@ -1,10 +1,10 @@
 """对话模型与结构化消息块。"""
 
 from typing import Dict, List, Any, Optional, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from datetime import datetime
-from ..utils.id_utils import new_id
-import json
+from ..utils.id_utils import new_id, new_msg_id
+from ..utils.json_utils import dumps
 
 
 class ContentBlock(BaseModel):
@@ -12,13 +12,16 @@ class ContentBlock(BaseModel):
     type: str = Field(..., description="类型: text|image|json")
     content: Any = Field(..., description="内容")
     extras: Optional[Dict[str, Any]] = Field(default_factory=dict, description="自定义扩展字段")
+    _serialized: Optional[str] = PrivateAttr(default=None)
     
     def __init__(self, **data):
-        # 只保留 type/content/extras，其他全部进 extras
-        extras = data.pop('extras', {})
-        known = {k: data.pop(k) for k in ['type', 'content'] if k in data}
-        extras.update(data)
-        super().__init__(**known, extras=extras)
+        # 只保留 type/content/extras，其他全部进 extras；剩余的关键字参数字典直接作为 extras，
+        # 只有同时显式传入 extras 时才合并（不修改调用方传入的字典）
+        known = {k: data.pop(k) for k in ('type', 'content') if k in data}
+        extras = data.pop('extras', None)
+        if extras:
+            data = {**extras, **data}
+        super().__init__(**known, extras=data)
     
     def get_extra(self, key: str, default=None):
         """获取自定义字段值。"""
@@ -33,13 +36,26 @@ class ContentBlock(BaseModel):
     def has_extra(self, key: str) -> bool:
         """检查是否存在指定的自定义字段。"""
         return bool(self.extras and key in self.extras)
+    
+    def serialized(self) -> str:
+        """content 的紧凑 JSON 序列化，首次调用后缓存；块加入内容后不应再修改 content。"""
+        if self._serialized is None:
+            self._serialized = dumps(self.content)
+        return self._serialized
 
 
 class Content(BaseModel):
-    """有序内容块集合，支持添加文本/图片/JSON。"""
+    """有序内容块集合，支持添加文本/图片/JSON。
+    
+    blocks 可直接追加/删除块，显示文本会按块数变化重建；
+    原地替换或修改已有块后，需先调用 clear_display_cache()。
+    """
     blocks: List[ContentBlock] = Field(default_factory=list, description="内容块列表")
+    _display_cache: Optional[str] = PrivateAttr(default=None)
+    # 显示缓存对应的块列表与块数，blocks 被外部追加/删除或整体替换时缓存失效
+    _display_key: Optional[tuple] = PrivateAttr(default=None)
 
-    def __init__(self, *items):
+    def __init__(self, *items, blocks: Optional[List[ContentBlock]] = None):
         """初始化结构化内容，支持混合项构建。
         
         支持输入类型：
@@ -56,13 +72,20 @@ class Content(BaseModel):
                 "开始文本", {'image': 'chart.png'}, {'json': {'data': 123}},
                 ("结束文本", {'style': 'bold'})  # 带自定义字段
             )
+        
+        blocks 仅用于从序列化数据（model_validate / model_validate_json）还原，不与 items 混用。
         """
+        if blocks is not None:
+            super().__init__(blocks=blocks)
+            return
         super().__init__()
         if len(items) == 1 and isinstance(items[0], str):
             self.add_text(items[0])
             return
-                
-        # 处理混合输入项
+        self.add_many(*items)
+
+    def add_many(self, *items) -> "Content":
+        """按顺序批量追加混合输入项（格式同构造函数），可在构造后继续使用。"""
         for item in items:
             extras = {}
             
@@ -78,20 +101,23 @@ class Content(BaseModel):
             if isinstance(item, str):
                 self.add_text(item, **extras)
             elif isinstance(item, dict):
-                if 'text' in item:
-                    self.add_text(item['text'], **extras)
-                elif 'image' in item:
-                    self.add_image(item['image'], **extras)
-                elif 'json' in item:
-                    self.add_json(item['json'], **extras)
+                # 常见的单键字典直接查表；多键时按 _DICT_ITEM_ADDERS 的优先级取第一个匹配的键
+                if len(item) == 1:
+                    key = next(iter(item))
                 else:
-                    raise ValueError(f"不支持的字典格式: {item}，应包含 'image' 或 'json' 键")
+                    key = next((k for k in _DICT_ITEM_ADDERS if k in item), None)
+                add = _DICT_ITEM_ADDERS.get(key)
+                if add is None:
+                    raise ValueError(f"不支持的字典格式: {item}，应包含 {list(_DICT_ITEM_ADDERS)} 之一的键")
+                add(self, item[key], **extras)
             else:
                 raise ValueError(f"不支持的输入类型: {type(item)}，当前值: {item}")
+        return self
 
     def add_text(self, text: str, **kwargs) -> "Content":
         """添加文本块到末尾，支持自定义字段。"""
         self.blocks.append(ContentBlock(type="text", content=text, **kwargs))
+        self._display_cache = None
         return self
 
     def add_image(self, image_url: str, **kwargs) -> "Content":
@@ -99,53 +125,104 @@ class Content(BaseModel):
         # HSC: not elegant, move out
         # 存储原始路径和解析后的路径
         # 在extras中存储原始路径，便于后续处理
-        from ..utils.image_utils import resolve_image_path
-        resolved_path = resolve_image_path(image_url)
-        if 'resolved_path' not in kwargs:
-            kwargs['resolved_path'] = resolved_path
+        # data URI 本身就是图片数据，不再复制一份到 resolved_path
+        if 'resolved_path' not in kwargs and not image_url.startswith('data:'):
+            from ..utils.image_utils import resolve_image_path
+            kwargs['resolved_path'] = resolve_image_path(image_url)
             
         self.blocks.append(ContentBlock(type="image", content=image_url, **kwargs))
+        self._display_cache = None
         return self
 
     def add_json(self, json_data: Dict[str, Any], **kwargs) -> "Content":
         """添加 JSON 块到末尾，支持自定义字段。"""
         self.blocks.append(ContentBlock(type="json", content=json_data, **kwargs))
+        self._display_cache = None
         return self
 
+    def clear_display_cache(self) -> None:
+        """使显示文本缓存失效；原地修改已有块后调用。"""
+        self._display_cache = None
+
     def to_display_text(self) -> str:
-        """把所有块合并为可读字符串，可选择显示自定义字段信息。"""
-        parts: List[str] = []
-        for block in self.blocks:
-            if block.type == "text":
-                text = str(block.content)
-                # 如果有样式信息，可以在显示时体现
-                if block.has_extra('style'):
-                    style = block.get_extra('style')
-                    text = f"[{style}]{text}[/{style}]" if style in ['bold', 'italic'] else text
-                parts.append(text)
-            elif block.type == "image":
-                img_text = f"[图片: {block.content}]"
-                # 显示图片描述信息
-                if block.has_extra('alt_text'):
-                    img_text = f"[图片: {block.content} - {block.get_extra('alt_text')}]"
-                elif block.has_extra('caption'):
-                    img_text = f"[图片: {block.content} - {block.get_extra('caption')}]"
-                parts.append(img_text)
-            elif block.type == "json":
-                json_text = f"[JSON: {json.dumps(block.content, ensure_ascii=False)}]"
-                # 显示JSON源信息
-                if block.has_extra('source'):
-                    json_text = f"[JSON({block.get_extra('source')}): {json.dumps(block.content, ensure_ascii=False)}]"
-                parts.append(json_text)
-        return " ".join(parts)
+        """把所有块合并为可读字符串，可选择显示自定义字段信息。
+        结果缓存；add_*、直接增删 blocks 或 clear_display_cache() 后重建。"""
+        blocks = self.blocks
+        key = self._display_key
+        if self._display_cache is not None and key[0] is blocks and key[1] == len(blocks):
+            return self._display_cache
+        self._display_key = (blocks, len(blocks))
+        renderers = _DISPLAY_RENDERERS
+        # 自定义字段缺失时用空字典，渲染函数直接查字典；未注册的块类型忽略
+        self._display_cache = " ".join([
+            render(block, block.extras or {}) for block in blocks
+            if (render := renderers.get(block.type)) is not None
+        ])
+        return self._display_cache
+
+
+def _render_text(block: ContentBlock, extras: Dict[str, Any]) -> str:
+    text = str(block.content)
+    # 如果有样式信息，可以在显示时体现
+    style = extras.get('style')
+    return f"[{style}]{text}[/{style}]" if style in ('bold', 'italic') else text
+
+
+def _short_image_ref(ref: str) -> str:
+    """图片引用的显示形式：data URI 只保留头部，不展开 base64"""
+    if ref.startswith('data:'):
+        return f"{ref.partition(',')[0]},..."
+    return ref
+
+
+def _render_image(block: ContentBlock, extras: Dict[str, Any]) -> str:
+    # 显示图片描述信息
+    ref = _short_image_ref(block.content)
+    if 'alt_text' in extras:
+        return f"[图片: {ref} - {extras['alt_text']}]"
+    if 'caption' in extras:
+        return f"[图片: {ref} - {extras['caption']}]"
+    return f"[图片: {ref}]"
+
+
+def _render_json(block: ContentBlock, extras: Dict[str, Any]) -> str:
+    # 显示JSON源信息
+    data = block.serialized()
+    return f"[JSON({extras['source']}): {data}]" if 'source' in extras else f"[JSON: {data}]"
+
+
+# 块类型 → 显示文本渲染函数（to_display_text 使用）；新增块类型时在此注册
+_DISPLAY_RENDERERS = {
+    'text': _render_text,
+    'image': _render_image,
+    'json': _render_json,
+}
+
+# 字典输入项的键 → 添加方法，按优先级排列；新增块类型时在此注册
+_DICT_ITEM_ADDERS = {
+    'text': Content.add_text,
+    'image': Content.add_image,
+    'json': Content.add_json,
+}
 
 
 class Message(BaseModel):
     """对话消息，包含角色、内容和时间戳。"""
-    msg_id: str = Field(default_factory=new_id, description="消息唯一标识符")
+    msg_id: str = Field(default_factory=new_msg_id, description="消息唯一标识符")
     role: str = Field(..., description="消息角色：system|user|assistant")
     content: Union[str, Content] = Field(..., description="消息内容")
     timestamp: datetime = Field(default_factory=datetime.now, description="消息时间戳")
+    _api_dict_cache: Optional[Dict[str, str]] = PrivateAttr(default=None)
+
+    def to_api_dict(self) -> Dict[str, str]:
+        """转换为 {"role", "content"} 文本消息；消息写入历史后不再修改，结果缓存复用，调用方勿修改"""
+        if self._api_dict_cache is None:
+            content = self.content
+            self._api_dict_cache = {
+                "role": self.role,
+                "content": content if type(content) is str else content.to_display_text(),
+            }
+        return self._api_dict_cache
 
 
 class ConversationState(BaseModel):
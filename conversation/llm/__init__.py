@@ -1,26 +1,72 @@
 """LLM模块 - 提供统一的语言模型接口和工厂函数"""
 
+import asyncio
 import os
+from functools import lru_cache
+from typing import List, Union
 from .base import BaseLLM
 from .mock import MockLLM
 from .ollama import OllamaLLM
 from .openai import OpenAILLM
+from .cache import ResponseCache, CachedLLM
+from ..core.modules import Message, Content
 from ..utils.logging import warn_once
 
-__all__ = ['BaseLLM', 'MockLLM', 'OllamaLLM', 'OpenAILLM', 'create_llm']
+__all__ = ['BaseLLM', 'MockLLM', 'OllamaLLM', 'OpenAILLM', 'ResponseCache', 'CachedLLM', 'create_llm', 'generate_many']
 
+# 持有连接池（绑定事件循环）的提供商：实例不在调用方之间共享，由各自的持有者 aclose()
+_POOLED_PROVIDERS = ("ollama", "openai", "oai")
 
-def create_llm(provider: str = None, **kwargs) -> BaseLLM:
-    """创建LLM实例，默认从环境变量LLM_NAME读取"""
-    provider = provider or os.getenv('LLM_NAME', 'mock').lower()
-    if os.getenv('LLM_NAME', None) is None:
-        warn_once(f"[LLM] | no provider specified, using {provider}")
 
+def _build_llm(provider: str, cache: Union[bool, ResponseCache], **kwargs) -> BaseLLM:
+    """按提供商构造LLM实例"""
     if provider == "mock":
-        return MockLLM(**kwargs)
+        llm = MockLLM(**kwargs)
     elif provider == "ollama":
-        return OllamaLLM(**kwargs)
+        llm = OllamaLLM(**kwargs)
     elif provider in ("openai", "oai"):
-        return OpenAILLM(**kwargs)
+        llm = OpenAILLM(**kwargs)
     else:
         raise ValueError(f"不支持的LLM提供商: {provider}")
+
+    if cache:
+        return CachedLLM(llm, cache if isinstance(cache, ResponseCache) else None)
+    return llm
+
+
+@lru_cache(maxsize=8)
+def _create_llm_cached(provider: str, cache: Union[bool, ResponseCache], kwargs_items: tuple) -> BaseLLM:
+    return _build_llm(provider, cache, **dict(kwargs_items))
+
+
+def create_llm(provider: str = None, cache: Union[bool, ResponseCache] = False, **kwargs) -> BaseLLM:
+    """
+    创建LLM实例，默认从环境变量LLM_NAME读取；cache 为 True 或 ResponseCache 时包装响应缓存。
+    不持有连接的提供商（mock）相同配置重复调用返回同一实例；ollama/openai 每次新建，
+    需要共享连接池时请复用同一实例并在结束时调用 aclose()。参数不可哈希时每次新建。
+    """
+    provider = provider or os.getenv('LLM_NAME', 'mock').lower()
+    if os.getenv('LLM_NAME', None) is None:
+        warn_once(f"[LLM] | no provider specified, using {provider}")
+
+    if provider in _POOLED_PROVIDERS:
+        return _build_llm(provider, cache, **kwargs)
+    kwargs_items = tuple(sorted(kwargs.items()))
+    try:
+        hash(kwargs_items)
+    except TypeError:
+        return _build_llm(provider, cache, **kwargs)
+    return _create_llm_cached(provider, cache, kwargs_items)
+
+
+async def generate_many(llms: List[BaseLLM], messages: List[Message],
+                        current_input: Content) -> List[Union[str, BaseException]]:
+    """
+    把同一输入并发发给多个LLM（模型对比/集成），耗时约为最慢的一次调用。
+    结果顺序与 llms 一致；单个失败以异常对象返回，不影响其他调用。
+    多个请求指向同一服务时，连接池的 limit_per_host 需不小于 len(llms)。
+    """
+    return await asyncio.gather(
+        *(llm.generate_response(messages, current_input) for llm in llms),
+        return_exceptions=True
+    )
@@ -1,13 +1,22 @@
 """LLM抽象基类定义"""
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, List, Dict
 from ..core.modules import Message, Content
+from ..utils.logging import warn_once
+
+# 每个LLM实例最多缓存的对话（历史列表）数
+_HISTORY_CACHE_SIZE = 128
 
 
 class BaseLLM(ABC):
     """LLM抽象基类，定义标准接口"""
     
+    # 子类同样声明 __slots__，实例不带 __dict__；_history_cache 由 _convert_history 按需创建
+    __slots__ = ("_history_cache",)
+    
     @abstractmethod
     def convert_messages(self, messages: List[Message], current_input: Content) -> List[Dict]:
         """将消息历史转换为特定LLM格式"""
@@ -16,4 +25,79 @@ class BaseLLM(ABC):
     @abstractmethod
     async def generate_response(self, messages: List[Message], current_input: Content) -> str:
         """生成回复文本"""
-        pass
\ No newline at end of file
+        pass
+    
+    async def stream_response(self, messages: List[Message], current_input: Content) -> AsyncIterator[str]:
+        """流式生成回复文本；默认实现一次性产出完整回复，支持流式的子类覆盖"""
+        yield await self.generate_response(messages, current_input)
+    
+    def _convert_history(self, messages: List[Message],
+                         convert_one: Callable[[Message], Any]) -> List[Any]:
+        """
+        逐条转换历史消息，并按历史列表缓存已转换的前缀，每轮只转换新增的消息。
+        依赖历史列表只追加、不修改已有消息（HistoryManager 的行为）；前缀不匹配时整体重建。
+        返回新列表，调用方可直接追加当前输入。
+        """
+        if not messages:
+            return []
+        cache = getattr(self, "_history_cache", None)
+        if cache is None:
+            cache = self._history_cache = OrderedDict()
+        
+        # 同一对话可能以不同格式转换（如Ollama的chat与generate），按转换函数区分
+        key = (id(messages), convert_one.__name__)
+        entry = cache.get(key)
+        # entry: [历史列表, 已转换结果, 已转换条数, 最后一条已转换消息]
+        if (entry is None or entry[0] is not messages or entry[2] > len(messages)
+                or (entry[2] and messages[entry[2] - 1] is not entry[3])):
+            entry = cache[key] = [messages, [], 0, None]
+        cache.move_to_end(key)
+        if len(cache) > _HISTORY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+        if entry[2] < len(messages):
+            entry[1].extend(convert_one(msg) for msg in messages[entry[2]:])
+            entry[2] = len(messages)
+            entry[3] = messages[-1]
+        return list(entry[1])
+    
+    def release_history(self, messages: List[Message]) -> None:
+        """对话结束时释放该历史列表的转换缓存，避免已结束的对话（含编码后的图片）常驻内存"""
+        cache = getattr(self, "_history_cache", None)
+        if cache:
+            list_id = id(messages)
+            for key in [k for k in cache if k[0] == list_id]:
+                del cache[key]
+    
+    async def aclose(self) -> None:
+        """释放底层连接等资源，默认无操作"""
+        pass
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+async def _close_on_loop(close: Callable[[], Any], loop, owner: str) -> None:
+    """
+    在连接资源所属的事件循环上执行 close()：当前循环直接等待；其他线程中仍在运行的循环交给它执行。
+    所属循环已结束时尽力在当前循环上关闭（部分客户端此时已无法关闭），之后丢弃旧资源。
+    """
+    if loop is None or loop is asyncio.get_running_loop():
+        await close()
+    elif loop.is_running():
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(close(), loop))
+    else:
+        _warn_stale_loop(owner)
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+def _warn_stale_loop(owner: str) -> None:
+    """连接资源所属的事件循环已结束，旧连接池将被丢弃并在新循环上重建"""
+    warn_once(f"[LLM] | {owner} 的连接池绑定在已结束的事件循环上，已丢弃并在当前循环重建；"
+              f"在原循环结束前调用 aclose()（或使用 async with）可正常关闭")
@@ -0,0 +1,101 @@
+"""LLM响应缓存：相同模型 + 相同消息直接返回缓存结果，跳过网络调用"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from .base import BaseLLM
+from ..core.modules import Message, Content
+from ..utils.json_utils import dumps_bytes
+
+
+class ResponseCache:
+    """
+    进程内 LRU 响应缓存，可选过期时间。
+
+    参数:
+        maxsize: 最大条目数，超出时淘汰最久未使用的条目
+        ttl: 过期秒数，None 表示不过期
+    属性:
+        stats: 命中/未命中计数
+    """
+
+    __slots__ = ("maxsize", "ttl", "_data", "stats")
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中或已过期返回 None"""
+        item = self._data.get(key)
+        if item is not None:
+            value, expires_at = item
+            if self.ttl is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self._data[key]
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        """写入缓存"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存与统计"""
+        self._data.clear()
+        self.stats = {"hits": 0, "misses": 0}
+
+
+class CachedLLM(BaseLLM):
+    """
+    为任意 BaseLLM 加上响应缓存的包装器。
+    键为 (LLM类型, 模型名, 历史消息, 当前输入) 的哈希；图片按路径参与计算，文件内容变化不会使缓存失效。
+    """
+
+    __slots__ = ("llm", "cache")
+
+    def __init__(self, llm: BaseLLM, cache: Optional[ResponseCache] = None):
+        self.llm = llm
+        self.cache = cache if cache is not None else ResponseCache()
+
+    def _cache_key(self, messages: List[Message], current_input: Content) -> str:
+        """计算缓存键"""
+        payload = {
+            "llm": type(self.llm).__name__,
+            "model": getattr(self.llm, "model", None),
+            "messages": [
+                [m.role, m.content if isinstance(m.content, str) else m.content.model_dump(mode="json")]
+                for m in messages
+            ],
+            "input": current_input.model_dump(mode="json") if current_input else None,
+        }
+        return hashlib.sha256(dumps_bytes(payload)).hexdigest()
+
+    def convert_messages(self, messages: List[Message], current_input: Content) -> List[Dict]:
+        """委托给被包装的LLM"""
+        return self.llm.convert_messages(messages, current_input)
+
+    async def generate_response(self, messages: List[Message], current_input: Content) -> str:
+        """命中缓存直接返回，否则调用被包装的LLM并写入缓存"""
+        key = self._cache_key(messages, current_input)
+        response = self.cache.get(key)
+        if response is None:
+            response = await self.llm.generate_response(messages, current_input)
+            self.cache.set(key, response)
+        return response
+
+    def release_history(self, messages: List[Message]) -> None:
+        """委托给被包装的LLM"""
+        self.llm.release_history(messages)
+
+    async def aclose(self) -> None:
+        await self.llm.aclose()
@@ -1,9 +1,13 @@
 """Mock LLM实现，用于测试"""
 
 import asyncio
+import os
 from typing import List, Dict
 from .base import BaseLLM
-from ..core.modules import Message, Content
+from ..core.modules import Message, Content, _short_image_ref
+
+# 模拟API延迟（秒），导入时读取 MOCK_LLM_DELAY，默认不等待
+_MOCK_DELAY = float(os.getenv('MOCK_LLM_DELAY') or 0)
 
 
 class MockLLM(BaseLLM):
@@ -12,23 +16,22 @@ class MockLLM(BaseLLM):
     模拟具有位置感知内容处理的LLM行为。
     """
     
+    __slots__ = ("latency",)
+    
+    def __init__(self, latency: float = None):
+        """latency: 每次调用模拟的延迟秒数，默认取 MOCK_LLM_DELAY（未设置时为0，不等待）"""
+        self.latency = latency if latency is not None else _MOCK_DELAY
+    
+    @staticmethod
+    def _convert_history_msg(msg: Message) -> Dict:
+        """转换单条历史消息"""
+        return msg.to_api_dict()
+    
     def convert_messages(self, messages: List[Message], 
                         current_input: Content) -> List[Dict]:
         """将历史消息与结构化输入转换为模拟格式（用于测试）"""
-        mock_messages = []
-        
-        # 转换历史消息
-        for msg in messages:
-            if isinstance(msg.content, str):
-                mock_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-            elif isinstance(msg.content, Content):
-                mock_messages.append({
-                    "role": msg.role,
-                    "content": msg.content.to_display_text()
-                })
+        # 转换历史消息（已转换的前缀按对话缓存）
+        mock_messages = self._convert_history(messages, self._convert_history_msg)
         
         # 转换当前输入
         if current_input:
@@ -42,25 +45,29 @@ class MockLLM(BaseLLM):
     async def generate_response(self, messages: List[Message], 
                               current_input: Content) -> str:
         """基于结构化输入生成模拟回复（用于测试，无外部依赖）"""
-        await asyncio.sleep(0.1)  # 模拟API延迟
+        # 模拟API延迟；未设置时仍让出一次事件循环，保持与真实调用相同的协作调度
+        await asyncio.sleep(self.latency)
         
         responses = ["我按指定顺序分析了您的内容："]
         
         # 处理每个内容块，按顺序
-        for i, blk in enumerate(current_input.blocks):
-            block_desc = f"第{i+1}项"
-
-            if blk.type == "text":
-                responses.append(f"{block_desc}: 文本内容 - {blk.content}")
-            elif blk.type == "image":
-                responses.append(f"{block_desc}: 图片文件 - {blk.content}")
-            elif blk.type == "json":
-                key_count = len(blk.content) if isinstance(blk.content, dict) else 0
-                responses.append(f"{block_desc}: 包含 {key_count} 个字段的JSON数据")
+        formatters = _BLOCK_FORMATTERS
+        for i, blk in enumerate(current_input.blocks, 1):
+            fmt = formatters.get(blk.type)
+            if fmt is not None:
+                responses.append(f"第{i}项: {fmt(blk)}")
         
         # 添加对话上下文
-        user_messages = [msg for msg in messages if msg.role == "user"]
-        if len(user_messages) > 0:
-            responses.append(f"这是我们对话中的第 #{len(user_messages) + 1} 次交互。")
+        user_count = sum(1 for msg in messages if msg.role == "user")
+        if user_count > 0:
+            responses.append(f"这是我们对话中的第 #{user_count + 1} 次交互。")
         
         return " ".join(responses)
+
+
+# 块类型 → 描述生成函数；新增块类型时在此注册
+_BLOCK_FORMATTERS = {
+    "text": lambda blk: f"文本内容 - {blk.content}",
+    "image": lambda blk: f"图片文件 - {_short_image_ref(blk.content)}",
+    "json": lambda blk: f"包含 {len(blk.content) if isinstance(blk.content, dict) else 0} 个字段的JSON数据",
+}
@@ -1,67 +1,154 @@
 """Ollama LLM实现"""
 
-import json
+import asyncio
 import os
-from typing import List, Dict
-from .base import BaseLLM
+from typing import AsyncIterator, Callable, List, Dict, Tuple
+from .base import BaseLLM, _close_on_loop
 from ..core.modules import Message, Content
 from ..utils.image_utils import load_image
+from ..utils.json_utils import dumps_bytes, loads
+
+try:
+    import aiohttp
+    _HAS_AIOHTTP = True
+except ImportError:
+    aiohttp = None
+    _HAS_AIOHTTP = False
+
+# 请求体由 dumps_bytes 预先序列化，需显式声明类型
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 环境变量默认配置，导入时解析一次（需在导入前 load_dotenv）
+_DEFAULTS = {
+    'model': os.getenv('OLLAMA_MODEL', 'qwen2.5vl:3b'),
+    'base_url': os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434'),
+    'timeout': int(os.getenv('OLLAMA_TIMEOUT', '30')),
+    'keep_alive': os.getenv('OLLAMA_KEEP_ALIVE') or None,
+}
+
+
+def _parse_keep_alive(value):
+    """keep_alive 取值：纯数字按秒（-1 表示常驻），其余如 '30m'、'24h' 原样交给服务端解析"""
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _image_block_to_text(blk) -> str:
+    """加载图片并转换为 data URI 文本；加载失败时用占位文本"""
+    image_data = load_image(blk.content, return_type="base64")
+    if image_data:
+        # Ollama支持base64图片，格式为 data:image/format;base64,data
+        img_format = image_data.get('format', 'PNG').lower()
+        base64_str = image_data.get('base64', '')
+        return f"data:image/{img_format};base64,{base64_str}"
+    return f"[图片: {blk.content}]"
+
+
+# 块类型 → 文本转换函数（/api/chat 当前输入）；未注册的类型忽略
+_BLOCK_HANDLERS = {
+    "text": lambda blk: blk.content,
+    "image": _image_block_to_text,
+    "json": lambda blk: f"[JSON数据: {blk.serialized()}]",
+}
+
+# /api/generate 的 prompt 文本：图片通过 images 字段单独传递
+_PROMPT_BLOCK_HANDLERS = {
+    "text": _BLOCK_HANDLERS["text"],
+    "json": _BLOCK_HANDLERS["json"],
+}
 
 
 class OllamaLLM(BaseLLM):
     """Ollama语言模型集成，支持多模态输入"""
     
-    def __init__(self, model: str = None, base_url: str = None, timeout: int = None):
-        """初始化Ollama集成，model/base_url/timeout可由环境变量覆盖"""
-        self.model = (
-            model if model is not None else 
-            os.getenv('OLLAMA_MODEL', 'qwen2.5vl:3b')
-        )
-        self.base_url = (
-            base_url if base_url is not None else
-            os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
-        )
-        self.timeout = (
-            timeout if timeout is not None else
-            int(os.getenv('OLLAMA_TIMEOUT', '30'))
+    __slots__ = ("model", "base_url", "timeout", "keep_alive", "_client_timeout", "_chat_url",
+                 "_generate_url", "_session", "_session_loop")
+    
+    def __init__(self, model: str = None, base_url: str = None, timeout: int = None,
+                 keep_alive=None):
+        """初始化Ollama集成，model/base_url/timeout/keep_alive可由环境变量覆盖；
+        keep_alive 为模型在服务端的驻留时长（如 '24h'，-1 为常驻），未设置时沿用服务端默认"""
+        if not _HAS_AIOHTTP:
+            raise ImportError("请安装aiohttp包: pip install aiohttp")
+        self.model = model if model is not None else _DEFAULTS['model']
+        self.base_url = base_url if base_url is not None else _DEFAULTS['base_url']
+        self.timeout = timeout if timeout is not None else _DEFAULTS['timeout']
+        self.keep_alive = _parse_keep_alive(keep_alive if keep_alive is not None else _DEFAULTS['keep_alive'])
+        self._client_timeout = aiohttp.ClientTimeout(total=self.timeout)
+        # 端点URL只拼接一次
+        self._chat_url = f"{self.base_url}/api/chat"
+        self._generate_url = f"{self.base_url}/api/generate"
+        # 复用的HTTP会话，首次请求时创建，保持连接池与keep-alive
+        self._session = None
+        self._session_loop = None
+
+    async def _get_session(self):
+        """获取共享的 ClientSession；会话绑定事件循环，已关闭时重建。
+        循环变化时在旧循环上关闭旧会话；旧循环已结束时尽力关闭后丢弃"""
+        loop = asyncio.get_running_loop()
+        old, old_loop = self._session, self._session_loop
+        stale = old is not None and not old.closed
+        if stale and old_loop is loop:
+            return old
+        # 先替换再关闭旧会话，关闭期间的并发调用直接拿到新会话
+        session = self._session = aiohttp.ClientSession(
+            timeout=self._client_timeout,
+            connector=aiohttp.TCPConnector(
+                limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300
+            ),
         )
+        self._session_loop = loop
+        if stale:
+            await _close_on_loop(old.close, old_loop, type(self).__name__)
+        return session
+
+    async def aclose(self) -> None:
+        """关闭共享的HTTP会话（在其所属的事件循环上执行）"""
+        if self._session is not None and not self._session.closed:
+            await _close_on_loop(self._session.close, self._session_loop, type(self).__name__)
+        self._session = None
+        self._session_loop = None
+
+    async def warmup(self) -> None:
+        """预加载模型：向 /api/generate 发送空 prompt，服务端只加载权重不生成，
+        可在其他准备工作期间以 create_task 调度，避免首个请求承担模型加载耗时"""
+        session = await self._get_session()
+        payload = {"model": self.model}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        async with session.post(self._generate_url, data=dumps_bytes(payload),
+                                headers=_JSON_HEADERS) as response:
+            await _raise_for_status(response)
+            await response.read()
+
+    @staticmethod
+    def _convert_history_msg(msg: Message) -> Dict:
+        """转换单条历史消息"""
+        return msg.to_api_dict()
+
+    @staticmethod
+    def _history_prompt_line(msg: Message) -> str:
+        """把单条历史消息转换为 /api/generate 的 prompt 行"""
+        api_msg = msg.to_api_dict()
+        return f"{api_msg['role']}: {api_msg['content']}"
 
     def convert_messages(self, messages: List[Message],
                         current_input: Content) -> List[Dict]:
         """将历史消息与结构化输入序列化为Ollama可用的消息列表"""
-        ollama_messages = []
-        
-        # 转换历史消息
-        for msg in messages:
-            if isinstance(msg.content, str):
-                ollama_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-            elif isinstance(msg.content, Content):
-                ollama_messages.append({
-                    "role": msg.role,
-                    "content": msg.content.to_display_text()
-                })
+        # 转换历史消息（已转换的前缀按对话缓存）
+        ollama_messages = self._convert_history(messages, self._convert_history_msg)
         
         # 转换当前输入
         if current_input:
-            content_parts = []
-            for blk in current_input.blocks:
-                if blk.type == "text":
-                    content_parts.append(blk.content)
-                elif blk.type == "image":
-                    # 加载并转换图片为base64供Ollama使用
-                    image_data = load_image(blk.content, return_type="base64")
-                    if image_data:
-                        # Ollama支持base64图片，格式为 data:image/format;base64,data
-                        img_format = image_data.get('format', 'PNG').lower()
-                        base64_str = image_data.get('base64', '')
-                        content_parts.append(f"data:image/{img_format};base64,{base64_str}")
-                    else:
-                        content_parts.append(f"[图片: {blk.content}]")
-                elif blk.type == "json":
-                    content_parts.append(f"[JSON数据: {json.dumps(blk.content, ensure_ascii=False)}]")
+            handlers = _BLOCK_HANDLERS
+            content_parts = [
+                handler(blk) for blk in current_input.blocks
+                if (handler := handlers.get(blk.type)) is not None
+            ]
             
             ollama_messages.append({
                 "role": "user",
@@ -70,75 +157,126 @@ class OllamaLLM(BaseLLM):
         
         return ollama_messages
     
-    async def generate_response(self, messages: List[Message], 
-                              current_input: Content) -> str:
-        """调用Ollama接口返回文本响应（异步），支持图片输入"""
-        import aiohttp
-        
-        # 检查当前输入是否包含图片
-        has_images = False
-        images = []
-        
-        if current_input:
-            for blk in current_input.blocks:
-                if blk.type == "image":
-                    image_data = load_image(blk.content, return_type="base64")
-                    if image_data:
-                        images.append(image_data.get('base64', ''))
-                        has_images = True
-        
+    def _build_request(self, messages: List[Message], current_input: Content, stream: bool,
+                       images: List[str]) -> Tuple[str, bytes, Callable[[Dict, str], str]]:
+        """构建请求，返回 (URL, 已序列化的请求体, 结果文本提取函数)；
+        images 为 _load_images 得到的当前输入图片，非空时使用/api/generate端点"""
         # 如果有图片，使用/api/generate端点
-        if has_images:
+        if images:
             # 构建文本prompt
-            prompt_parts = []
-            for msg in messages:
-                if isinstance(msg.content, str):
-                    prompt_parts.append(f"{msg.role}: {msg.content}")
-                elif isinstance(msg.content, Content):
-                    prompt_parts.append(f"{msg.role}: {msg.content.to_display_text()}")
+            prompt_parts = self._convert_history(messages, self._history_prompt_line)
             
             if current_input:
-                user_text = []
-                for blk in current_input.blocks:
-                    if blk.type == "text":
-                        user_text.append(blk.content)
-                    elif blk.type == "json":
-                        user_text.append(f"[JSON数据: {json.dumps(blk.content, ensure_ascii=False)}]")
+                handlers = _PROMPT_BLOCK_HANDLERS
+                user_text = [
+                    handler(blk) for blk in current_input.blocks
+                    if (handler := handlers.get(blk.type)) is not None
+                ]
                 prompt_parts.append(f"user: {' '.join(user_text)}")
             
             payload = {
                 "model": self.model,
                 "prompt": "\n".join(prompt_parts),
                 "images": images,
-                "stream": False
+                "stream": stream
             }
-            
-            timeout = aiohttp.ClientTimeout(total=self.timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload
-                ) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    return result.get('response', 'No response generated')
-        
+            url, extract = self._generate_url, _generate_text
         else:
             # 没有图片，使用原来的/api/chat端点
-            ollama_messages = self.convert_messages(messages, current_input)
-            
             payload = {
                 "model": self.model,
-                "messages": ollama_messages,
-                "stream": False
+                "messages": self.convert_messages(messages, current_input),
+                "stream": stream
             }
-            
-            timeout = aiohttp.ClientTimeout(total=self.timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    f"{self.base_url}/api/chat",
-                    json=payload
-                ) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    return result.get('message', {}).get('content', 'No response generated')
+            url, extract = self._chat_url, _chat_text
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return url, dumps_bytes(payload), extract
+
+    async def generate_response(self, messages: List[Message], 
+                              current_input: Content) -> str:
+        """调用Ollama接口返回文本响应（异步），支持图片输入"""
+        session = await self._get_session()
+        images = await _load_images(current_input)
+        url, body, extract = self._build_request(messages, current_input, stream=False, images=images)
+        
+        async with session.post(
+            url,
+            data=body,
+            headers=_JSON_HEADERS
+        ) as response:
+            await _raise_for_status(response)
+            result = loads(await response.read())
+            return extract(result, 'No response generated')
+
+    async def stream_response(self, messages: List[Message],
+                              current_input: Content) -> AsyncIterator[str]:
+        """流式调用Ollama接口，逐段产出生成的文本；响应为每行一个JSON对象"""
+        session = await self._get_session()
+        images = await _load_images(current_input)
+        url, body, extract = self._build_request(messages, current_input, stream=True, images=images)
+        
+        async with session.post(
+            url,
+            data=body,
+            headers=_JSON_HEADERS
+        ) as response:
+            await _raise_for_status(response)
+            # 按到达的数据块读取，手动按换行切分；缓冲区只保留未完成的一行
+            buf = bytearray()
+            async for data in response.content.iter_any():
+                buf += data
+                while (nl := buf.find(b"\n")) != -1:
+                    line = bytes(buf[:nl]).strip()
+                    del buf[:nl + 1]
+                    if line and (chunk := extract(loads(line), '')):
+                        yield chunk
+            # 末行可能不带换行符
+            line = bytes(buf).strip()
+            if line and (chunk := extract(loads(line), '')):
+                yield chunk
+
+
+def _read_images(blocks) -> List[str]:
+    """读取并编码图片块，返回 base64 列表"""
+    images = []
+    for blk in blocks:
+        if blk.type == "image":
+            image_data = load_image(blk.content, return_type="base64")
+            if image_data:
+                images.append(image_data.get('base64', ''))
+    return images
+
+
+async def _load_images(current_input: Content) -> List[str]:
+    """加载当前输入中的图片；文件/网络读取与编码放到线程中执行，不阻塞事件循环上的其他请求"""
+    if not current_input or not any(blk.type == "image" for blk in current_input.blocks):
+        return []
+    return await asyncio.to_thread(_read_images, current_input.blocks)
+
+
+async def _raise_for_status(response) -> None:
+    """非2xx响应时读取Ollama返回的错误信息（同样用快速JSON解析），再抛出 ClientResponseError"""
+    if response.status < 400:
+        return
+    message = response.reason
+    try:
+        body = loads(await response.read())
+        if isinstance(body, dict) and body.get('error'):
+            message = body['error']
+    except ValueError:
+        pass
+    raise aiohttp.ClientResponseError(
+        response.request_info, response.history,
+        status=response.status, message=message, headers=response.headers
+    )
+
+
+def _generate_text(result: Dict, default: str) -> str:
+    """/api/generate 响应中的文本"""
+    return result.get('response', default)
+
+
+def _chat_text(result: Dict, default: str) -> str:
+    """/api/chat 响应中的文本"""
+    return result.get('message', {}).get('content', default)
@@ -1,140 +1,183 @@
 """OpenAI LLM实现"""
 
-import json
+import asyncio
 import os
-from typing import List, Dict
-from .base import BaseLLM
+from typing import AsyncIterator, List, Dict
+from .base import BaseLLM, _close_on_loop, _warn_stale_loop
 from ..core.modules import Message, Content
 from ..utils.image_utils import load_image
 
+# 环境变量默认配置，导入时解析一次（需在导入前 load_dotenv）
+_DEFAULTS = {
+    'model': os.getenv('OPENAI_MODEL'),
+    'api_key': os.getenv('OPENAI_API_KEY'),
+    'base_url': os.getenv('OPENAI_BASE_URL'),
+    'timeout': int(os.getenv('OPENAI_TIMEOUT', '60')),
+    'http2': os.getenv('OPENAI_HTTP2', '').lower() in ('1', 'true', 'yes'),
+}
+
+
+def _image_block_to_part(blk) -> Dict:
+    """加载图片并转换为 image_url 片段；加载失败时用占位文本"""
+    image_data = load_image(blk.content, return_type="base64")
+    if image_data:
+        img_format = image_data.get('format', 'PNG').lower()
+        base64_str = image_data.get('base64', '')
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/{img_format};base64,{base64_str}"
+            }
+        }
+    return {"type": "text", "text": f"[图片: {blk.content}]"}
+
+
+# 块类型 → OpenAI content 片段转换函数；未注册的类型忽略
+_BLOCK_HANDLERS = {
+    "text": lambda blk: {"type": "text", "text": blk.content},
+    "image": _image_block_to_part,
+    "json": lambda blk: {"type": "text", "text": f"[JSON数据: {blk.serialized()}]"},
+}
+
 
 class OpenAILLM(BaseLLM):
     """OpenAI语言模型集成，支持多模态输入"""
     
+    __slots__ = ("model", "api_key", "base_url", "timeout", "http2",
+                 "_client_cls", "_http_client_cls", "_client", "_client_loop")
+    
     def __init__(self, model: str = None, api_key: str = None, 
-                 base_url: str = None, timeout: int = None):
-        """可选覆盖默认配置"""
-        self.model = model if model is not None else os.getenv('OPENAI_MODEL')
-        self.api_key = api_key if api_key is not None else os.getenv('OPENAI_API_KEY')
-        self.base_url = base_url if base_url is not None else os.getenv('OPENAI_BASE_URL')
-        self.timeout = timeout if timeout is not None else int(os.getenv('OPENAI_TIMEOUT'))            
+                 base_url: str = None, timeout: int = None, http2: bool = None):
+        """可选覆盖默认配置；http2=True 时并发请求复用同一连接多路传输（需 pip install httpx[http2]）"""
+        self.model = model if model is not None else _DEFAULTS['model']
+        self.api_key = api_key if api_key is not None else _DEFAULTS['api_key']
+        self.base_url = base_url if base_url is not None else _DEFAULTS['base_url']
+        self.timeout = timeout if timeout is not None else _DEFAULTS['timeout']
+        self.http2 = http2 if http2 is not None else _DEFAULTS['http2']
         if not self.api_key:
             raise ValueError("需要设置OPENAI_API_KEY环境变量")
         
-        # 初始化客户端
+        # 检查依赖；客户端在首次请求时创建
         try:
             from openai import AsyncOpenAI
-            self.client = AsyncOpenAI(
+        except ImportError:
+            raise ImportError("请安装openai包: pip install openai")
+        self._client_cls = AsyncOpenAI
+        self._http_client_cls = None
+        if self.http2:
+            # DefaultAsyncHttpxClient 在较早的 openai 1.x 中不存在，只在启用HTTP/2时导入
+            try:
+                from openai import DefaultAsyncHttpxClient
+            except ImportError:
+                raise ImportError("启用HTTP/2需要较新的openai包: pip install -U openai")
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                raise ImportError("启用HTTP/2需要安装h2包: pip install httpx[http2]")
+            self._http_client_cls = DefaultAsyncHttpxClient
+        self._client = None
+        self._client_loop = None
+    
+    @property
+    def client(self):
+        """AsyncOpenAI 客户端；连接池绑定事件循环，aclose 之后重建。
+        循环变化时旧客户端交给仍在运行的旧循环关闭；旧循环已结束时无法关闭，直接丢弃"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            old, old_loop = self._client, self._client_loop
+            if old is not None:
+                if old_loop.is_running():
+                    asyncio.run_coroutine_threadsafe(old.close(), old_loop)
+                else:
+                    _warn_stale_loop(type(self).__name__)
+            self._client = self._client_cls(
                 api_key=self.api_key,
                 base_url=self.base_url,
                 timeout=self.timeout,
+                # 保留SDK默认的连接池配置，仅切换协议
+                http_client=self._http_client_cls(http2=True) if self.http2 else None,
             )
-        except ImportError:
-            raise ImportError("请安装openai包: pip install openai")
+            self._client_loop = loop
+        return self._client
+    
+    async def aclose(self) -> None:
+        """关闭底层 AsyncOpenAI 客户端的连接池（在其所属的事件循环上执行）"""
+        if self._client is not None:
+            await _close_on_loop(self._client.close, self._client_loop, type(self).__name__)
+        self._client = None
+        self._client_loop = None
+    
+    def _content_to_openai(self, content: Content):
+        """把结构化内容转换为OpenAI消息的content：单个文本块为字符串，否则为多模态列表"""
+        handlers = _BLOCK_HANDLERS
+        content_parts = [
+            handler(blk) for blk in content.blocks
+            if (handler := handlers.get(blk.type)) is not None
+        ]
+        has_media = any(part["type"] == "image_url" for part in content_parts)
+        
+        if has_media or len(content_parts) > 1:
+            # 多模态内容
+            return content_parts
+        # 纯文本内容
+        return content_parts[0]["text"] if content_parts else ""
     
+    def _convert_history_msg(self, msg: Message) -> Dict:
+        """转换单条历史消息"""
+        if isinstance(msg.content, str):
+            return {"role": msg.role, "content": msg.content}
+        return {"role": msg.role, "content": self._content_to_openai(msg.content)}
     
     def convert_messages(self, messages: List[Message], 
                         current_input: Content) -> List[Dict]:
         """将历史消息与结构化输入序列化为OpenAI可用的消息列表"""
-        openai_messages = []
-        
-        # 转换历史消息
-        for msg in messages:
-            if isinstance(msg.content, str):
-                openai_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-            elif isinstance(msg.content, Content):
-                # 检查是否有多模态内容
-                content_parts = []
-                has_media = False
-                
-                for blk in msg.content.blocks:
-                    if blk.type == "text":
-                        content_parts.append({"type": "text", "text": blk.content})
-                    elif blk.type == "image":
-                        image_data = load_image(blk.content, return_type="base64")
-                        if image_data:
-                            img_format = image_data.get('format', 'PNG').lower()
-                            base64_str = image_data.get('base64', '')
-                            content_parts.append({
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/{img_format};base64,{base64_str}"
-                                }
-                            })
-                            has_media = True
-                        else:
-                            content_parts.append({"type": "text", "text": f"[图片: {blk.content}]"})
-                    elif blk.type == "json":
-                        json_text = json.dumps(blk.content, ensure_ascii=False)
-                        content_parts.append({"type": "text", "text": f"[JSON数据: {json_text}]"})
-                
-                if has_media or len(content_parts) > 1:
-                    # 多模态内容
-                    openai_messages.append({
-                        "role": msg.role,
-                        "content": content_parts
-                    })
-                else:
-                    # 纯文本内容
-                    text_content = content_parts[0]["text"] if content_parts else ""
-                    openai_messages.append({
-                        "role": msg.role,
-                        "content": text_content
-                    })
+        # 转换历史消息（已转换的前缀按对话缓存，历史图片不再重复编码）
+        openai_messages = self._convert_history(messages, self._convert_history_msg)
         
         # 转换当前输入
         if current_input:
-            content_parts = []
-            has_media = False
-            
-            for blk in current_input.blocks:
-                if blk.type == "text":
-                    content_parts.append({"type": "text", "text": blk.content})
-                elif blk.type == "image":
-                    image_data = load_image(blk.content, return_type="base64")
-                    if image_data:
-                        img_format = image_data.get('format', 'PNG').lower()
-                        base64_str = image_data.get('base64', '')
-                        content_parts.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/{img_format};base64,{base64_str}"
-                            }
-                        })
-                        has_media = True
-                    else:
-                        content_parts.append({"type": "text", "text": f"[图片: {blk.content}]"})
-                elif blk.type == "json":
-                    json_text = json.dumps(blk.content, ensure_ascii=False)
-                    content_parts.append({"type": "text", "text": f"[JSON数据: {json_text}]"})
-            
-            if has_media or len(content_parts) > 1:
-                # 多模态内容
-                openai_messages.append({
-                    "role": "user",
-                    "content": content_parts
-                })
-            else:
-                # 纯文本内容
-                text_content = content_parts[0]["text"] if content_parts else ""
-                openai_messages.append({
-                    "role": "user",
-                    "content": text_content
-                })
+            openai_messages.append({
+                "role": "user",
+                "content": self._content_to_openai(current_input)
+            })
         
         return openai_messages
     
+    async def _convert_messages_async(self, messages: List[Message],
+                                      current_input: Content) -> List[Dict]:
+        """同 convert_messages；当前输入含图片时，其读取与编码放到线程中执行，不阻塞事件循环。
+        历史转换共享按对话的缓存，仍在事件循环内执行"""
+        if not current_input or not any(blk.type == "image" for blk in current_input.blocks):
+            return self.convert_messages(messages, current_input)
+        openai_messages = self._convert_history(messages, self._convert_history_msg)
+        openai_messages.append({
+            "role": "user",
+            "content": await asyncio.to_thread(self._content_to_openai, current_input)
+        })
+        return openai_messages
     
     async def generate_response(self, messages: List[Message], 
                               current_input: Content) -> str:
         """调用OpenAI接口返回文本响应（异步）"""
-        openai_messages = self.convert_messages(messages, current_input)
+        openai_messages = await self._convert_messages_async(messages, current_input)
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=openai_messages,
         )
         
-        return response.choices[0].message.content
\ No newline at end of file
+        return response.choices[0].message.content
+    
+    async def stream_response(self, messages: List[Message],
+                              current_input: Content) -> AsyncIterator[str]:
+        """流式调用OpenAI接口，逐段产出生成的文本"""
+        openai_messages = await self._convert_messages_async(messages, current_input)
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=openai_messages,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
@@ -5,12 +5,11 @@
 将对话记录转换为 LLaMA-Factory 兼容的多模态格式，
 支持图片、音频、视频等多种模态内容。
 """
-import json
 import os
 from pathlib import Path
 from typing import Dict, List, Any, Optional
-from datetime import datetime
-from ..core.modules import History, Message, Content, ContentBlock
+from ..core.modules import History, Content, ContentBlock
+from .json_utils import dumps_bytes
 
 
 class MultimodalExporter:
@@ -31,40 +30,10 @@ class MultimodalExporter:
         """加载对话记录文件"""
         try:
             file_path = self.conversations_dir / conversation_file
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            # 重构消息格式
-            messages = []
-            for msg_data in data.get('messages', []):
-                if isinstance(msg_data['content'], dict) and 'blocks' in msg_data['content']:
-                    # 结构化内容
-                    content = Content()
-                    for block in msg_data['content']['blocks']:
-                        content.blocks.append(ContentBlock(
-                            type=block['type'],
-                            content=block['content'],
-                            extras=block.get('extras', {})
-                        ))
-                else:
-                    # 简单文本内容
-                    content = msg_data['content']
-                
-                messages.append(Message(
-                    msg_id=msg_data['msg_id'],
-                    role=msg_data['role'],
-                    content=content,
-                    timestamp=datetime.fromisoformat(msg_data['timestamp'])
-                ))
-            
-            return History(
-                conv_id=data['conv_id'],
-                messages=messages,
-                created_at=datetime.fromisoformat(data['created_at']),
-                updated_at=datetime.fromisoformat(data['updated_at']),
-                system_prompt=data.get('system_prompt'),
-                metadata=data.get('metadata')
-            )
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            # 整个文件交给 pydantic-core 一次性校验还原；解析时重复的短字符串（role/type）共享同一对象
+            return History.model_validate_json(data)
             
         except Exception as e:
             print(f"❌ 加载对话文件失败 {conversation_file}: {e}")
@@ -133,7 +102,7 @@ class MultimodalExporter:
                             current_media_files['videos'].append(file_path)
                     elif block.type == 'json':
                         # JSON数据转为文本描述
-                        json_text = f"数据: {json.dumps(block.content, ensure_ascii=False)}"
+                        json_text = f"数据: {block.serialized()}"
                         content_parts.append(json_text)
                 
                 current_message_content = "".join(content_parts)
@@ -197,8 +166,8 @@ class MultimodalExporter:
         
         try:
             output_path = output_directory / output_file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump([llamafactory_data], f, ensure_ascii=False, indent=2)
+            with open(output_path, 'wb') as f:
+                f.write(dumps_bytes([llamafactory_data], indent=True))
             
             print(f"✅ 导出成功: {output_path}")
             return True
@@ -240,8 +209,8 @@ class MultimodalExporter:
         
         try:
             output_path = output_directory / output_file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(all_conversations, f, ensure_ascii=False, indent=2)
+            with open(output_path, 'wb') as f:
+                f.write(dumps_bytes(all_conversations, indent=True))
             
             print(f"✅ 批量导出成功: {output_path}")
             print(f"📊 导出对话数量: {len(all_conversations)}")
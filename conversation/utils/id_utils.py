@@ -1,6 +1,23 @@
 """ID生成和处理工具函数"""
 
-import uuid
+import itertools
+import os
+import secrets
+
+# 进程级随机前缀 + 递增计数，用于高频生成的消息ID
+_MSG_ID_PREFIX = secrets.token_hex(8)
+_MSG_ID_COUNTER = itertools.count()
+
+
+def _reset_msg_id_state() -> None:
+    """fork 后子进程重新生成前缀，避免与父进程产生相同的ID"""
+    global _MSG_ID_PREFIX, _MSG_ID_COUNTER
+    _MSG_ID_PREFIX = secrets.token_hex(8)
+    _MSG_ID_COUNTER = itertools.count()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_msg_id_state)
 
 
 def shortcut_id(full_id: str, length: int = 8) -> str:
@@ -11,5 +28,11 @@ def shortcut_id(full_id: str, length: int = 8) -> str:
 
 
 def new_id() -> str:
-    """生成新的对话ID"""
-    return str(uuid.uuid4())
+    """生成新的对话ID：32位十六进制随机串（128位熵，与 uuid4 相当，省去 UUID 对象与连字符格式化）"""
+    return secrets.token_hex(16)
+
+
+def new_msg_id() -> str:
+    """生成新的消息ID：进程随机前缀 + 计数，32位十六进制，不触发随机数系统调用。
+    前缀相同，不适合用 shortcut_id 区分；对话ID仍用 new_id"""
+    return f"{_MSG_ID_PREFIX}{next(_MSG_ID_COUNTER):016x}"
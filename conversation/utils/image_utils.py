@@ -1,5 +1,6 @@
 import io
 import base64
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from PIL import Image
@@ -10,9 +11,9 @@ from conversation.utils.logging import warn_once
 
 
 def resolve_image_path(image_path: str) -> str:
-    """解析图片路径，支持相对路径、绝对路径和URL"""
-    # URL直接返回
-    if image_path.startswith(('http://', 'https://')):
+    """解析图片路径，支持相对路径、绝对路径、URL和 data URI"""
+    # URL / data URI 直接返回
+    if image_path.startswith(('http://', 'https://', 'data:')):
         return image_path
     
     # 绝对路径直接返回
@@ -45,18 +46,30 @@ def load_image(image_path: str, return_type: str = "base64") -> Optional[object]
     返回: 
         PIL.Image 或 base64 字符串，失败返回 None。
     """
-    # TODO: 处理 base64 的输入
     # 解析图片路径
     resolved_path = resolve_image_path(image_path)
     
+    # data URI：已编码的图片，base64 直接返回，无需解码再编码
+    if resolved_path.startswith("data:"):
+        header, _, img_b64 = resolved_path.partition(",")
+        fmt = header[len("data:image/"):].split(";", 1)[0].upper() or "PNG"
+        if return_type == "base64":
+            return {"base64": img_b64, "format": fmt}
+        img_bytes = io.BytesIO(base64.b64decode(img_b64))
     # 判断是否为URL
-    if resolved_path.startswith("http://") or resolved_path.startswith("https://"):
+    elif resolved_path.startswith("http://") or resolved_path.startswith("https://"):
         resp = requests.get(resolved_path, timeout=10)
         resp.raise_for_status()
         img_bytes = io.BytesIO(resp.content)
     else:
-        if not os.path.exists(resolved_path):
+        try:
+            st = os.stat(resolved_path)
+        except OSError:
             raise FileNotFoundError(f"文件不存在: {resolved_path}")
+        if return_type == "base64":
+            # 本地文件按 (路径, 修改时间, 大小) 缓存编码结果，文件变化后自动重新编码
+            img_b64, fmt = _encode_local_image(resolved_path, st.st_mtime_ns, st.st_size)
+            return {"base64": img_b64, "format": fmt}
         with open(resolved_path, 'rb') as f:
             img_bytes = io.BytesIO(f.read())
     img = Image.open(img_bytes)
@@ -64,9 +77,21 @@ def load_image(image_path: str, return_type: str = "base64") -> Optional[object]
     if return_type == "image":
         return {"image": img, "format": fmt}
     elif return_type == "base64":
-        buffered = io.BytesIO()
-        img.save(buffered, format=fmt)
-        img_b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        return {"base64": img_b64, "format": fmt}
+        return {"base64": _encode_image(img, fmt), "format": fmt}
     else:
-        raise ValueError(f"不支持的返回类型: {return_type}")
\ No newline at end of file
+        raise ValueError(f"不支持的返回类型: {return_type}")
+
+
+def _encode_image(img, fmt: str) -> str:
+    """按原格式重新保存并编码为 base64 字符串"""
+    buffered = io.BytesIO()
+    img.save(buffered, format=fmt)
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+@lru_cache(maxsize=16)
+def _encode_local_image(path: str, mtime_ns: int, size: int):
+    """读取并编码本地图片，返回 (base64, 格式)；mtime_ns/size 只参与缓存键"""
+    with Image.open(path) as img:
+        fmt = img.format or "PNG"
+        return _encode_image(img, fmt), fmt
@@ -0,0 +1,37 @@
+"""JSON序列化工具：优先使用orjson，未安装时退回标准库json"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    # 选项位在导入时组合好，调用时直接传入
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+    _OPTIONS_INDENT = orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2
+
+    def dumps(obj, indent: bool = False) -> str:
+        """序列化为字符串，保留非ASCII字符；indent=True 时缩进2格"""
+        return dumps_bytes(obj, indent).decode('utf-8')
+
+    def dumps_bytes(obj, indent: bool = False) -> bytes:
+        """序列化为UTF-8字节，可直接作为HTTP请求体或写入文件；indent=True 时缩进2格"""
+        return orjson.dumps(obj, option=_OPTIONS_INDENT if indent else _OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj, indent: bool = False) -> str:
+        """序列化为字符串，保留非ASCII字符；indent=True 时缩进2格"""
+        # 分隔符与 orjson 输出一致：紧凑模式无空格，缩进模式键值之间一个空格
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2)
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(obj, indent: bool = False) -> bytes:
+        """序列化为UTF-8字节，可直接作为HTTP请求体或写入文件；indent=True 时缩进2格"""
+        return dumps(obj, indent).encode('utf-8')
+
+    loads = json.loads
@@ -10,6 +10,11 @@ import time
 import json
 import os
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -22,35 +27,82 @@ SAVE_CONVERSATIONS = True  # 全局控制是否保存对话到文件
 
 # 测试图像路径
 TEST_IMAGE_PATH = "./data/images/test_image.jpg"
+# 传文件路径即可：编码结果按文件缓存，各图像任务不会重复编码
+TEST_IMAGE = TEST_IMAGE_PATH if os.path.exists(TEST_IMAGE_PATH) else None
 
 class SimpleConcurrentTest:
     """简化的并发测试类"""
 
+    def __init__(self, measure_isolated: bool = True):
+        # measure_isolated=False 时各测试阶段并发运行，总耗时更短，但吞吐数据会互相干扰
+        self.measure_isolated = measure_isolated
+        # 各测试的清理任务在后台运行，与下一阶段重叠，最后统一等待
+        self._pending_cleanup = []
+
+    def _schedule_cleanup(self, graph, successful):
+        """后台调度已完成对话的保存与清理，不阻塞当前测试"""
+        self._pending_cleanup.extend(
+            asyncio.create_task(graph.end(r['conv_id'], save=SAVE_CONVERSATIONS))
+            for r in successful if r.get('conv_id')
+        )
+
+    @staticmethod
+    async def _warmup(graph) -> bool:
+        """计时前先发一次请求，预热连接池/模型加载，结果丢弃。
+        失败时（如服务未启动）只打印错误并继续，由各测试照常统计、报告并完成清理"""
+        try:
+            warmup = await graph.chat(content=Content("ping"))
+            await graph.end(warmup['conv_id'], save=False)
+            return True
+        except Exception as e:
+            print(f"  ⚠️  预热失败，继续测试: {e}")
+            return False
+
+    @staticmethod
+    async def _collect_successful(tasks):
+        """按完成顺序收集成功结果，失败的任务直接跳过"""
+        successful = []
+        append = successful.append  # 绑定方法，循环内少一次属性查找
+        for fut in asyncio.as_completed(tasks):
+            try:
+                append(await fut)
+            except Exception:
+                pass
+        return successful
+
+    async def flush_cleanup(self):
+        """等待所有后台清理任务完成"""
+        pending, self._pending_cleanup = self._pending_cleanup, []
+        if not pending:
+            return
+        done, _ = await asyncio.wait(pending)  # 不需要结果列表，只等待完成
+        for t in done:
+            t.exception()  # 取出异常，避免 "exception was never retrieved" 警告
+
     async def basic_concurrent_test(self, concurrent_levels=[1, 3, 5, 7, 9, 11, 13, 15, 17]):
         """基本并发性能测试"""
         print("🔄 基本并发测试...")
         
         results = []
+        graph = ConversationGraph(llm=LLM)  # 各并发级别复用同一个图，只调整信号量
+        await self._warmup(graph)
         for concurrent in concurrent_levels:
             print(f"\n📊 并发数: {concurrent}")
             
-            graph = ConversationGraph(llm=LLM, max_concurrent=concurrent)
+            graph.set_max_concurrent(concurrent)
 
-            # 创建测试任务
-            prompts = [f"计算{i}+{i}" for i in range(1, concurrent+1)]
+            # 创建测试内容（计时区间之外）
+            contents = [Content(f"任务{i}: 计算{i+1}+{i+1}") for i in range(concurrent)]
             
-            start_time = time.time()
-            tasks = [
-                graph.chat(content=Content(f"任务{i}: {prompt}"))
-                for i, prompt in enumerate(prompts)
-            ]
+            loop = asyncio.get_running_loop()
+            start_time = loop.time()
+            tasks = [graph.chat(content=c) for c in contents]
             
-            completed = await asyncio.gather(*tasks, return_exceptions=True)
-            elapsed = time.time() - start_time
+            successful = await self._collect_successful(tasks)
+            elapsed = loop.time() - start_time
             
             # 统计结果
-            successful = [r for r in completed if not isinstance(r, Exception)]
-            success_rate = len(successful) / len(completed) * 100
+            success_rate = len(successful) / len(tasks) * 100
             
             result = {
                 "concurrent": concurrent,
@@ -64,12 +116,8 @@ class SimpleConcurrentTest:
             print(f"  耗时: {elapsed:.2f}s")
             print(f"  吞吐: {result['throughput']:.1f} req/s")
             
-            # 清理
-            cleanup_tasks = [
-                graph.end(r['conv_id'], save=SAVE_CONVERSATIONS)
-                for r in successful if r.get('conv_id')
-            ]
-            await asyncio.gather(*cleanup_tasks, return_exceptions=True)
+            # 清理（后台进行）
+            self._schedule_cleanup(graph, successful)
         
         return results
     
@@ -77,21 +125,23 @@ class SimpleConcurrentTest:
         """多轮对话并发测试"""
         print(f"\n🔄 多轮对话并发测试 ({num_conversations}个对话)...")
         
-        async def single_conversation(conv_id):
+        # 对话状态按 conv_id 隔离，所有对话共享同一个图（及其LLM客户端）
+        graph = ConversationGraph(llm=LLM, max_concurrent=num_conversations)
+        await self._warmup(graph)
+        
+        async def single_conversation(conv_id, first_content, second_content):
             """单个对话流程"""
-            graph = ConversationGraph(llm=LLM)
-            
             try:
                 # 第一轮
                 result1 = await graph.chat(
-                    system_prompt=f"你是助手{conv_id}",
-                    content=Content(f"对话{conv_id}: 介绍你自己")
+                    system_prompt="你是助手",  # 固定系统提示，便于服务端复用前缀缓存
+                    content=first_content
                 )
                 
                 # 第二轮
                 result2 = await graph.chat(
                     conv_id=result1['conv_id'],
-                    content=Content("我刚才说了什么？")
+                    content=second_content
                 )
                 
                 # 清理对话 - 使用全局配置
@@ -106,14 +156,20 @@ class SimpleConcurrentTest:
             except Exception as e:
                 return {"conv_id": conv_id, "success": False, "error": str(e)}
         
-        start_time = time.time()
-        conversation_tasks = [
-            single_conversation(i) 
+        # 预先构建各轮内容（计时区间之外）
+        contents = [
+            (Content(f"对话{i}: 我是助手{i}，请介绍你自己"), Content("我刚才说了什么？"))
             for i in range(num_conversations)
         ]
         
-        results = await asyncio.gather(*conversation_tasks)
-        elapsed = time.time() - start_time
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        # single_conversation 自行捕获异常，单个对话失败不影响其他对话
+        results = await asyncio.gather(*(
+            single_conversation(i, first, second)
+            for i, (first, second) in enumerate(contents)
+        ))
+        elapsed = loop.time() - start_time
         
         # 统计
         successful = [r for r in results if r['success']]
@@ -128,33 +184,33 @@ class SimpleConcurrentTest:
         print("\n🔄 图像并发测试...")
         
         # 检查测试图像是否存在
-        if not os.path.exists(TEST_IMAGE_PATH):
+        if TEST_IMAGE is None:
             print(f"⚠️  测试图像不存在: {TEST_IMAGE_PATH}")
             return []
         
         results = []
+        graph = ConversationGraph(llm=LLM)
+        await self._warmup(graph)
         for concurrent in concurrent_levels:
             print(f"\n📊 图像并发数: {concurrent}")
             
-            graph = ConversationGraph(llm=LLM, max_concurrent=concurrent)
+            graph.set_max_concurrent(concurrent)
             
             try:
-                # 创建图像测试任务
-                tasks = []
-                for i in range(concurrent):
-                    content = Content(
-                        f"任务{i+1}: 描述这个图片",
-                        {'image': TEST_IMAGE_PATH}
-                    )
-                    tasks.append(graph.chat(content=content))
+                # 创建图像测试内容（计时区间之外）
+                contents = [
+                    Content(f"任务{i+1}: 描述这个图片", {'image': TEST_IMAGE})
+                    for i in range(concurrent)
+                ]
                 
-                start_time = time.time()
-                completed = await asyncio.gather(*tasks, return_exceptions=True)
-                elapsed = time.time() - start_time
+                loop = asyncio.get_running_loop()
+                start_time = loop.time()
+                tasks = [graph.chat(content=c) for c in contents]
+                successful = await self._collect_successful(tasks)
+                elapsed = loop.time() - start_time
                 
                 # 统计结果
-                successful = [r for r in completed if not isinstance(r, Exception)]
-                success_rate = len(successful) / len(completed) * 100
+                success_rate = len(successful) / len(tasks) * 100
                 
                 result = {
                     "concurrent": concurrent,
@@ -169,12 +225,8 @@ class SimpleConcurrentTest:
                 print(f"  耗时: {elapsed:.2f}s")
                 print(f"  吞吐: {result['throughput']:.1f} req/s")
                 
-                # 清理
-                cleanup_tasks = [
-                    graph.end(r['conv_id'], save=SAVE_CONVERSATIONS)
-                    for r in successful if r.get('conv_id')
-                ]
-                await asyncio.gather(*cleanup_tasks, return_exceptions=True)
+                # 清理（后台进行）
+                self._schedule_cleanup(graph, successful)
                 
             except Exception as e:
                 print(f"  图像测试失败: {e}")
@@ -188,32 +240,40 @@ class SimpleConcurrentTest:
         
         graph = ConversationGraph(llm=LLM, max_concurrent=num_tasks)
         
-        tasks = []
+        def from_template(template, text):
+            """复制模板，只替换首个文本块"""
+            content = template.model_copy(deep=True)
+            content.blocks[0].content = text
+            return content
+        
+        # 结构固定的模板只构建一次，避免每个任务重新解析输入项
+        text_template = Content("")
+        image_template = Content("", {'image': TEST_IMAGE}) if TEST_IMAGE is not None else None
+        
+        contents = []
         try:
-            # 创建混合任务：一半文本，一半图像
+            # 创建混合内容（计时区间之外）：一半文本，一半图像
             for i in range(num_tasks):
                 if i % 2 == 0:
                     # 文本任务
-                    content = Content(f"任务{i+1}: 计算{i+1}的平方")
+                    content = from_template(text_template, f"任务{i+1}: 计算{i+1}的平方")
                 else:
                     # 图像任务
-                    if os.path.exists(TEST_IMAGE_PATH):
-                        content = Content(
-                            f"任务{i+1}: 简要描述图片内容",
-                            {'image': TEST_IMAGE_PATH}
-                        )
+                    if image_template is not None:
+                        content = from_template(image_template, f"任务{i+1}: 简要描述图片内容")
                     else:
-                        content = Content(f"任务{i+1}: 描述一个理想的测试图片")
-                
-                tasks.append(graph.chat(content=content))
+                        content = from_template(text_template, f"任务{i+1}: 描述一个理想的测试图片")
+                contents.append(content)
             
-            start_time = time.time()
-            completed = await asyncio.gather(*tasks, return_exceptions=True)
-            elapsed = time.time() - start_time
+            await self._warmup(graph)
+            loop = asyncio.get_running_loop()
+            start_time = loop.time()
+            tasks = [graph.chat(content=c) for c in contents]
+            successful = await self._collect_successful(tasks)
+            elapsed = loop.time() - start_time
             
             # 统计结果
-            successful = [r for r in completed if not isinstance(r, Exception)]
-            text_tasks = len([i for i in range(num_tasks) if i % 2 == 0])
+            text_tasks = (num_tasks + 1) // 2  # 偶数下标为文本任务
             image_tasks = num_tasks - text_tasks
             
             print(f"  总任务: {num_tasks} (文本: {text_tasks}, 图像: {image_tasks})")
@@ -221,12 +281,8 @@ class SimpleConcurrentTest:
             print(f"  总耗时: {elapsed:.2f}s")
             print(f"  平均耗时: {elapsed/num_tasks:.2f}s/任务")
             
-            # 清理
-            cleanup_tasks = [
-                graph.end(r['conv_id'], save=SAVE_CONVERSATIONS)
-                for r in successful if r.get('conv_id')
-            ]
-            await asyncio.gather(*cleanup_tasks, return_exceptions=True)
+            # 清理（后台进行）
+            self._schedule_cleanup(graph, successful)
             
             return {
                 "total_tasks": num_tasks,
@@ -247,10 +303,17 @@ class SimpleConcurrentTest:
 
         basic_results = multi_round_results = image_results = mixed_results = None
         
-        # basic_results = await self.basic_concurrent_test()
-        # multi_round_results = await self.multi_round_concurrent_test()
-        image_results = await self.image_concurrent_test()
-        mixed_results = await self.mixed_content_test()
+        if self.measure_isolated:
+            # basic_results = await self.basic_concurrent_test()
+            # multi_round_results = await self.multi_round_concurrent_test()
+            image_results = await self.image_concurrent_test()
+            mixed_results = await self.mixed_content_test()
+        else:
+            image_results, mixed_results = await asyncio.gather(
+                self.image_concurrent_test(),
+                self.mixed_content_test(),
+            )
+        await self.flush_cleanup()
 
         # 保存结果
         all_results = {
@@ -262,8 +325,12 @@ class SimpleConcurrentTest:
         }
         
         result_file = f"log/test_results_{int(time.time())}.json"
-        with open(result_file, 'w', encoding='utf-8') as f:
-            json.dump(all_results, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            with open(result_file, 'wb') as f:
+                f.write(orjson.dumps(all_results, option=orjson.OPT_INDENT_2))
+        else:
+            with open(result_file, 'w', encoding='utf-8') as f:
+                json.dump(all_results, f, indent=2, ensure_ascii=False)
         
         print(f"\n📝 测试结果保存到: {result_file}")
         
@@ -291,6 +358,8 @@ async def main():
     except Exception as e:
         print(f"❌ 测试失败: {e}")
         return None
+    finally:
+        await LLM.aclose()  # 关闭共享的HTTP连接
 
 
 if __name__ == "__main__":
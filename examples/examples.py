@@ -2,15 +2,34 @@
 
 import asyncio
 import os
-import time
 from dotenv import load_dotenv
 load_dotenv()
 
 # 然后导入conversation模块
 from conversation.core import ConversationGraph, Content
+from conversation.llm import create_llm
 from conversation.utils.logging import get_logger
 logger = get_logger(__name__)
 
+# 并发演示用的mock模型延迟（秒）：有延迟时各级别的耗时/吞吐才能体现并发效果
+_DEMO_LATENCY = 0.1
+
+# 演示用的固定数据：模块级只构建一次，各次调用复用
+# _INTRO_CONTENT 只放稳定的用户画像前缀，具体指令在调用时追加，便于服务端复用前缀缓存
+_USER_JSON = {
+    "user_id": "U12345",
+    "name": "张敏", 
+    "age": 28,
+    "location": "旧金山"
+}
+_INTRO_CONTENT = Content(
+    "我需要分析以下用户数据。",
+    "首先，这是用户基本信息：",
+    {'json': _USER_JSON},
+    "这是他们的行为截图：",
+    {'image': "test_image.jpg"},
+)
+
 
 class ConversationBuilder:
     """构建器：生成演示用的多轮对话与结构化内容。"""
@@ -28,28 +47,16 @@ class ConversationBuilder:
         """示例：创建一轮数据分析对话并返回 conv_id。"""
         print("📊 创建数据分析对话...")
         
-        # 第一条消息：带结构化数据的介绍
-        intro_content = Content(
-            "我需要分析以下用户数据。",
-            "首先，这是用户基本信息：",
-            {'json': {
-                "user_id": "U12345",
-                "name": "张敏", 
-                "age": 28,
-                "location": "旧金山"
-            }},
-            "这是他们的行为截图：",
-            {'image': "test_image.jpg"},
-            "请提供初步分析。"
-        )
+        # 第一条消息：固定的用户画像前缀 + 本次指令；第二轮只追加新增的指标数据
+        intro_content = _INTRO_CONTENT.model_copy(deep=True).add_text("请提供初步分析。")
         
-        result1 = await self.graph.chat(
+        # 第一轮先调度，等待LLM期间构建第二轮内容（第二轮依赖 conv_id，不能并发）
+        task1 = asyncio.create_task(self.graph.chat(
             system_prompt="你是资深用户行为分析师，擅长从多模态数据中提取洞见。",
             content=intro_content,
-        )
-        
-        conv_id = result1['conv_id']
-        print(f"初步分析: {result1['response'][:100]}...")
+        ))
+        # 让出一次事件循环，第一轮先运行到请求发出（首个 await）后再同步构建第二轮内容
+        await asyncio.sleep(0)
         
         # 后续详细指标
         metrics_content = Content(
@@ -67,6 +74,10 @@ class ConversationBuilder:
             "你的建议是什么？"
         )
         
+        result1 = await task1
+        conv_id = result1['conv_id']
+        print(f"初步分析: {result1['response'][:100]}...")
+        
         result2 = await self.graph.chat(
             conv_id=conv_id,
             content=metrics_content
@@ -152,9 +163,6 @@ async def demonstrate_positioning_control():
     # 测试1: 顺序添加
     content1 = Content()
     content1.add_text("开始").add_image("test_image.jpg").add_json({"test": 1})
-    result1 = await graph.chat(content=content1)
-    # FIXME: no input_preview key in result now
-    print(f"顺序添加: {result1['input_preview'][:50]}...")
     
     # 测试2: 工厂方法构造
     content2 = Content(
@@ -162,36 +170,48 @@ async def demonstrate_positioning_control():
         {'image': 'test_image.jpg'}, 
         {'json': {'data': 123}}
     )
-    result2 = await graph.chat(content=content2)
+    
+    # 两个对话互不依赖，并发执行
+    result1, result2 = await asyncio.gather(
+        graph.chat(content=content1, include_preview=True),
+        graph.chat(content=content2, include_preview=True),
+    )
+    print(f"顺序添加: {result1['input_preview'][:50]}...")
     print(f"工厂方法: {result2['input_preview'][:50]}...")
     
     # 清理
-    await graph.end(result1['conv_id'], save=False)
-    await graph.end(result2['conv_id'], save=False)
+    await asyncio.gather(
+        graph.end(result1['conv_id'], save=False),
+        graph.end(result2['conv_id'], save=False),
+    )
 
 
 async def batch_conversation_processing():
     """批量并发示例，轻量级并发测试。"""
     print("🔥 批量会话并发测试...")
     
-    graph = ConversationGraph(llm='mock', max_concurrent=5)
+    graph = ConversationGraph(llm=create_llm('mock', latency=_DEMO_LATENCY), max_concurrent=5)
     
-    # 创建简化的测试任务
-    tasks = []
-    for i in range(3):  # 减少任务数量，提高效率
-        content = Content(f"任务 #{i+1}: 简单计算", {'json': {"id": i+1}})
-        task = graph.chat(system_prompt="简洁回答", content=content)
-        tasks.append(task)
+    # 创建简化的测试内容
+    contents = [
+        Content(f"任务 #{i+1}: 简单计算", {'json': {"id": i+1}})
+        for i in range(3)  # 减少任务数量，提高效率
+    ]
     
-    start_time = time.time()
-    results = await asyncio.gather(*tasks)
-    elapsed = time.time() - start_time
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    results = await asyncio.gather(*(
+        graph.chat(system_prompt="简洁回答", content=c) for c in contents
+    ))
+    elapsed = loop.time() - start_time
     
     print(f"✅ 完成 {len(results)} 个会话，耗时 {elapsed:.2f}s")
     
     # 批量清理
-    cleanup_tasks = [graph.end(r['conv_id'], save=False) for r in results]
-    await asyncio.gather(*cleanup_tasks)
+    cleanup_tasks = [asyncio.create_task(graph.end(r['conv_id'], save=False)) for r in results]
+    done, _ = await asyncio.wait(cleanup_tasks)  # 不需要结果列表，只等待完成
+    for t in done:
+        t.result()  # 保持原有行为：清理失败时抛出
 
 
 async def concurrent_inference_test():
@@ -203,16 +223,20 @@ async def concurrent_inference_test():
     # 测试不同的并发级别
     concurrent_levels = [1, 3, 5]
     
+    # 只构建一次图，各级别仅调整信号量，避免初始化开销掩盖调度差异
+    graph = ConversationGraph(llm=create_llm('mock', latency=_DEMO_LATENCY),
+                              max_concurrent=max(concurrent_levels))
     for concurrent in concurrent_levels:
         print(f"\n📊 测试并发数: {concurrent}")
         
-        graph = ConversationGraph(llm='mock', max_concurrent=concurrent)
+        graph.set_max_concurrent(concurrent)
         
         # 创建测试任务
         prompts = ["计算1+1", "解释AI", "写函数", "推荐书籍"]
         tasks = []
         
-        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
         for i, prompt in enumerate(prompts[:concurrent]):
             content = Content(f"任务{i+1}: {prompt}")
             task = graph.chat(content=content)
@@ -220,7 +244,7 @@ async def concurrent_inference_test():
         
         # 执行并统计
         results = await asyncio.gather(*tasks, return_exceptions=True)
-        elapsed = time.time() - start_time
+        elapsed = loop.time() - start_time
         
         successful = [r for r in results if not isinstance(r, Exception)]
         
@@ -230,11 +254,13 @@ async def concurrent_inference_test():
         
         # 清理
         cleanup_tasks = [
-            graph.end(r['conv_id'], save=False) 
-            for r in successful if hasattr(r, 'get') and r.get('conv_id')
+            asyncio.create_task(graph.end(r['conv_id'], save=False))
+            for r in successful if r.get('conv_id')
         ]
         if cleanup_tasks:
-            await asyncio.gather(*cleanup_tasks, return_exceptions=True)
+            done, _ = await asyncio.wait(cleanup_tasks)
+            for t in done:
+                t.exception()  # 取出异常，避免 "exception was never retrieved" 警告
 
 
 async def multi_round_conversation_test():
@@ -10,18 +10,35 @@ load_dotenv()
 
 import os
 import json
+import asyncio
 import base64
+import hashlib
+import logging
+import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, ClassVar
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+try:
+    # pybase64 带 SIMD 编码路径，大图编码更快；未安装时退回标准库
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    _b64encode = base64.b64encode
+
 from pydantic import BaseModel, Field
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
-from langchain_ollama import OllamaLLM
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from PIL import Image
+
+logger = logging.getLogger(__name__)
 
 
 # 结构化输出模型定义
@@ -33,125 +50,344 @@ class AnalysisResponse(BaseModel):
     tags: List[str] = Field(description="相关标签", default=[])
 
 
+class BatchAnswers(BaseModel):
+    """批量问答的结构化输出模型"""
+    answers: List[str] = Field(description="按题号顺序给出的回答，每题一项")
+
+
+class BatchAnalyses(BaseModel):
+    """结构化批量问答的输出模型，每题一个 AnalysisResponse"""
+    answers: List[AnalysisResponse] = Field(description="按题号顺序给出的分析结果，每题一项")
+
+
+@lru_cache(maxsize=64)
+def _encode_image_cached(path: str, mtime_ns: int, size: int) -> str:
+    """按 (路径, 修改时间, 大小) 缓存图片的 base64 编码，文件变化后自动失效"""
+    return _b64encode(Path(path).read_bytes()).decode('ascii')
+
+
+@lru_cache(maxsize=16)
+def _get_llm(model_type: str, model_name: str, kwargs_items: Tuple):
+    """按配置缓存LLM客户端，多个 ChatManager 复用已建立的连接"""
+    model_kwargs = dict(kwargs_items)
+    if model_type == "openai":
+        return ChatOpenAI(
+            model=model_name,
+            base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            **model_kwargs
+        )
+    elif model_type == "ollama":
+        # 仅在使用 Ollama 时才导入，避免其他场景的启动开销
+        from langchain_ollama import OllamaLLM
+        return OllamaLLM(
+            model=model_name,
+            base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+            **model_kwargs
+        )
+    raise ValueError(f"不支持的模型类型: {model_type}")
+
+
+# LangChain 消息类型 -> Ollama 角色
+_OLLAMA_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+# 多模态消息模板：结构固定，只预编译一次，每轮仅填入文本和图片数据
+_MULTIMODAL_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", [
+        {"type": "text", "text": "{text}"},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,{image_data}"}},
+    ])
+])
+
+
+# 进程内响应缓存：(模型, 结构化标志, 历史摘要, 归一化问题) -> (AI消息, 结果)，多个 ChatManager 共享；
+# 历史摘要包含系统提示与之前的对话，同一问题在不同上下文中不会共用回答
+_RESPONSE_CACHE: Dict[Tuple, Tuple[Any, Dict[str, Any]]] = {}
+_RESPONSE_CACHE_SIZE = 256
+
+# 单次合并请求的最大问题数；批次越大，单次响应越慢
+_BATCH_MAX = 8
+
+# 支持 json_schema 结构化输出（response_format）的 OpenAI 模型前缀，取保守集合；
+# gpt-3.5-turbo、gpt-4-vision-preview 等较早的模型不支持，仍走 PydanticOutputParser 文本解析
+_JSON_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o3", "o4")
+
+
+def _supports_json_schema(model_type: str, model_name: str) -> bool:
+    """模型是否支持原生 json_schema 结构化输出"""
+    return model_type == "openai" and model_name.startswith(_JSON_SCHEMA_MODEL_PREFIXES)
+
+
+def _message_records(msgs) -> List[Dict[str, Any]]:
+    """把消息转换为日志记录，同一批共用一个时间戳"""
+    ts = datetime.now().isoformat()
+    return [{"type": msg.__class__.__name__, "content": msg.content, "timestamp": ts} for msg in msgs]
+
+
+def _encode_log_line(record: Dict[str, Any]) -> bytes:
+    """编码为一行 JSONL"""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
 class ChatManager:
-    """轻量级对话管理器"""
+    """轻量级对话管理器；用 async with 管理时退出即关闭对话日志"""
+    
+    _SAVE_DIR: ClassVar[Optional[Path]] = None
+    _SAVE_DIR_LOCK: ClassVar[threading.Lock] = threading.Lock()
+    
+    @classmethod
+    def _get_save_dir(cls) -> Path:
+        """解析保存目录并创建，所有实例共享结果"""
+        if cls._SAVE_DIR is None:
+            with cls._SAVE_DIR_LOCK:
+                if cls._SAVE_DIR is None:
+                    save_dir = Path(os.getenv("HISTORY_SAVE_DIR", "./log/conv_log/draft"))
+                    save_dir.mkdir(parents=True, exist_ok=True)
+                    cls._SAVE_DIR = save_dir
+        return cls._SAVE_DIR
     
     def __init__(self, 
                  system_prompt: str = "你是一个有帮助的AI助手。",
                  model_type: str = "openai",
                  model_name: str = "gpt-3.5-turbo",
                  use_structured: bool = False,
+                 enable_cache: bool = False,
                  **model_kwargs):
         
         self.system_prompt = system_prompt
         self.use_structured = use_structured
+        self.enable_cache = enable_cache
         self.model_type = model_type
         self.model_name = model_name
         
-        # 初始化LLM（简化版，仅支持主流模型）
-        if model_type == "openai":
-            self.llm = ChatOpenAI(
-                model=model_name,
-                base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
-                **model_kwargs
-            )
-        elif model_type == "ollama":
-            self.llm = OllamaLLM(
-                model=model_name,
-                base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
-                **model_kwargs
-            )
-        else:
-            raise ValueError(f"不支持的模型类型: {model_type}")
+        # 初始化LLM（简化版，仅支持主流模型）；相同配置的实例共享同一客户端及其连接池
+        self.llm = _get_llm(model_type, model_name, tuple(sorted(model_kwargs.items())))
+        
+        # Ollama 异步调用直接走官方 AsyncClient，可与服务端的多个并行槽位重叠执行
+        self.async_client = None
+        if model_type == "ollama":
+            from ollama import AsyncClient
+            self.async_client = AsyncClient(host=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+            self._ollama_options = model_kwargs
         
         # 对话历史
         self.messages = [SystemMessage(content=system_prompt)]
-        self.conversation_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 精确到微秒，避免同一秒内创建的多个对话写入同一日志文件
+        self.conversation_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        
+        # 结构化输出：支持的 OpenAI 模型走原生 JSON Schema 模式，直接返回校验后的对象，无需在提示词后附加格式说明；
+        # 其他模型（较早的 OpenAI 模型、Ollama 文本模型）退回到 PydanticOutputParser 解析文本
+        self._json_schema = _supports_json_schema(model_type, model_name)
+        self.structured_llm = None
+        self.parser = None
+        if use_structured:
+            if self._json_schema:
+                self.structured_llm = self.llm.with_structured_output(
+                    AnalysisResponse, method="json_schema", include_raw=True
+                )
+            else:
+                self.parser = PydanticOutputParser(pydantic_object=AnalysisResponse)
+        # 格式说明在解析器生命周期内不变，只生成一次
+        self.format_instructions = self.parser.get_format_instructions() if self.parser else ""
+        # batch_ask 使用的结构化客户端，首次调用时创建
+        self._batch_llm = None
         
-        # 结构化输出解析器（如果需要）
-        self.parser = PydanticOutputParser(pydantic_object=AnalysisResponse) if use_structured else None
+        # 保存目录（进程内只解析、创建一次）
+        self.save_dir = ChatManager._get_save_dir()
         
-        # 保存目录
-        save_dir = os.getenv("HISTORY_SAVE_DIR", "./log/conv_log/draft")
-        self.save_dir = Path(save_dir)
-        self.save_dir.mkdir(parents=True, exist_ok=True)
+        # 追加式 JSONL 日志：每轮只写新增消息，保存时无需重新序列化整个历史。
+        # 文件在首次写入时才创建，头部记录先缓存在内存中，未产生对话时不留下空文件
+        self.log_path = self.save_dir / f"{self.conversation_id}.jsonl"
+        self._log_fh = None
+        self._pending_log = [_encode_log_line({
+            "conversation_id": self.conversation_id,
+            "model": f"{model_type}:{model_name}",
+            "structured_output": use_structured,
+            "timestamp": datetime.now().isoformat()
+        })]
+        self._pending_log.extend(map(_encode_log_line, _message_records(self.messages)))
+    
+    def _log_file(self):
+        """返回日志文件句柄；首次调用时创建文件并写入缓存的头部记录"""
+        if self._log_fh is None:
+            self._log_fh = open(self.log_path, "ab")
+            self._log_fh.writelines(self._pending_log)
+            self._pending_log = None
+        return self._log_fh
+    
+    def _log_messages(self, msgs) -> None:
+        """把消息逐条写入日志，同一批共用一个时间戳"""
+        self._log_file().writelines(map(_encode_log_line, _message_records(msgs)))
+    
+    def _append_history(self, *msgs) -> None:
+        """写回历史并追加到日志"""
+        self.messages.extend(msgs)
+        self._log_messages(msgs)
     
     def _encode_image(self, image_path: str) -> str:
-        """编码图片为base64"""
-        with open(image_path, "rb") as f:
-            return base64.b64encode(f.read()).decode('utf-8')
+        """编码图片为base64（同一图片重复使用时复用缓存）"""
+        st = os.stat(image_path)
+        return _encode_image_cached(image_path, st.st_mtime_ns, st.st_size)
     
     def _create_multimodal_message(self, text: str, image_path: str) -> HumanMessage:
         """创建多模态消息"""
-        base64_image = self._encode_image(image_path)
-        content = [
-            {"type": "text", "text": text},
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-        ]
-        return HumanMessage(content=content)
+        return _MULTIMODAL_PROMPT.format_messages(
+            text=text, image_data=self._encode_image(image_path)
+        )[0]
+    
+    def _build_user_message(self, user_input: str, image_path: Optional[str] = None) -> HumanMessage:
+        """构建用户消息（结构化输出时附加格式说明）"""
+        # 文本解析模式下，添加格式说明
+        if self.parser:
+            user_input += f"\n\n请严格按照以下JSON格式回答，不要添加任何其他内容：\n{self.format_instructions}"
+        
+        # 创建用户消息
+        if image_path and os.path.exists(image_path):
+            return self._create_multimodal_message(user_input, image_path)
+        return HumanMessage(content=user_input)
+    
+    def _parse_structured_output(self, output: Dict[str, Any]) -> Dict[str, Any]:
+        """整理 with_structured_output(include_raw=True) 的返回结果"""
+        raw = output["raw"].content
+        parsed = output["parsed"]
+        if parsed is None:
+            return {
+                "success": True,
+                "response": raw,
+                "raw": raw,
+                "structured": False,
+                "parse_error": str(output["parsing_error"])
+            }
+        return {
+            "success": True,
+            "response": parsed.model_dump(),
+            "raw": raw,
+            "structured": True
+        }
+    
+    def _parse_response(self, response) -> Dict[str, Any]:
+        """解析模型响应"""
+        if self.parser:
+            try:
+                # 清理响应内容，只保留</think>之后的部分
+                content = response.content
+                _, sep, tail = content.partition('</think>')
+                clean_response = (tail if sep else content).strip()
+                
+                # 提取第一个{到最后一个}之间的JSON部分
+                start = clean_response.find('{')
+                end = clean_response.rfind('}') + 1
+                json_content = clean_response[start:end] if start != -1 and end > start else clean_response
+                
+                # 解析一次 JSON，只做一次 Pydantic 校验，直接返回解析出的 dict（不再 parse → model_dump 往返）
+                data = _json_loads(json_content)
+                AnalysisResponse.model_validate(data)
+                
+                return {
+                    "success": True,
+                    "response": data,
+                    "raw": response.content,
+                    "structured": True
+                }
+            except Exception as e:
+                return {
+                    "success": True,
+                    "response": response.content,
+                    "raw": response.content,
+                    "structured": False,
+                    "parse_error": str(e)
+                }
+        return {
+            "success": True,
+            "response": response.content,
+            "raw": response.content,
+            "structured": False
+        }
+    
+    def _history_digest(self) -> str:
+        """当前对话历史（含系统提示）的摘要"""
+        h = hashlib.sha256()
+        for msg in self.messages:
+            h.update(f"{msg.type}\0{msg.content!r}\0".encode("utf-8"))
+        return h.hexdigest()
+    
+    def _cache_key(self, user_input: str, image_path: Optional[str],
+                   history_digest: Optional[str] = None) -> Optional[Tuple]:
+        """生成响应缓存键；未启用缓存或含图片时返回 None。history_digest 可由批量调用预先计算"""
+        if not self.enable_cache or image_path:
+            return None
+        # 归一化空白，避免仅空格/换行不同的重复提问未命中
+        normalized = " ".join(user_input.split())
+        return (self.model_type, self.model_name, self.use_structured,
+                history_digest or self._history_digest(), normalized)
+    
+    @staticmethod
+    def _store_cache(cache_key: Optional[Tuple], response, result: Dict[str, Any]) -> None:
+        """成功结果写入响应缓存"""
+        if cache_key is not None and result["success"] and cache_key not in _RESPONSE_CACHE:
+            if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_SIZE:
+                _RESPONSE_CACHE.pop(next(iter(_RESPONSE_CACHE)))  # 淘汰最早写入的条目
+            _RESPONSE_CACHE[cache_key] = (response, result)
+    
+    def _record_turn(self, user_msg, response, result: Dict[str, Any], cache_key: Optional[Tuple]) -> Dict[str, Any]:
+        """写回本轮历史，成功结果写入缓存"""
+        self._append_history(user_msg, response)
+        self._store_cache(cache_key, response, result)
+        return dict(result)
     
     def chat(self, user_input: str, image_path: Optional[str] = None) -> Dict[str, Any]:
         """进行对话 - 核心功能"""
         try:
-            # 如果使用结构化输出，添加格式说明
-            if self.use_structured and self.parser:
-                format_instructions = self.parser.get_format_instructions()
-                user_input += f"\n\n请严格按照以下JSON格式回答，不要添加任何其他内容：\n{format_instructions}"
+            user_msg = self._build_user_message(user_input, image_path)
+            messages = self.messages + [user_msg]
             
-            # 创建用户消息
-            if image_path and os.path.exists(image_path):
-                user_msg = self._create_multimodal_message(user_input, image_path)
+            # 命中缓存则跳过模型调用
+            cache_key = self._cache_key(user_input, image_path)
+            cached = _RESPONSE_CACHE.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                response, result = cached
+            elif self.structured_llm is not None:
+                output = self.structured_llm.invoke(messages)
+                response, result = output["raw"], self._parse_structured_output(output)
             else:
-                user_msg = HumanMessage(content=user_input)
+                response = self.llm.invoke(messages)
+                result = self._parse_response(response)
             
-            self.messages.append(user_msg)
-            
-            # 调用模型
-            response = self.llm.invoke(self.messages)
-            self.messages.append(response)
+            return self._record_turn(user_msg, response, result, cache_key)
+                
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "response": None
+            }
+    
+    async def achat(self, user_input: str, image_path: Optional[str] = None) -> Dict[str, Any]:
+        """异步对话，可与其他 achat 并发执行"""
+        try:
+            user_msg = self._build_user_message(user_input, image_path)
+            # 使用本次调用的局部消息列表，并发调用之间不会互相改写 self.messages
+            messages = self.messages + [user_msg]
             
-            # 解析响应
-            if self.use_structured and self.parser:
-                try:
-                    # 清理响应内容，移除可能的思考标签
-                    clean_response = response.content.strip()
-                    # 如果有<think>标签，提取JSON部分
-                    if '<think>' in clean_response and '</think>' in clean_response:
-                        # 找到</think>后的内容
-                        json_start = clean_response.find('</think>') + 8
-                        clean_response = clean_response[json_start:].strip()
-                    
-                    # 尝试提取JSON部分
-                    if '{' in clean_response and '}' in clean_response:
-                        start = clean_response.find('{')
-                        # 找到最后一个}
-                        end = clean_response.rfind('}') + 1
-                        json_content = clean_response[start:end]
-                        parsed = self.parser.parse(json_content)
-                    else:
-                        parsed = self.parser.parse(clean_response)
-                    
-                    return {
-                        "success": True,
-                        "response": parsed.model_dump(),
-                        "raw": response.content,
-                        "structured": True
-                    }
-                except Exception as e:
-                    return {
-                        "success": True,
-                        "response": response.content,
-                        "raw": response.content,
-                        "structured": False,
-                        "parse_error": str(e)
-                    }
+            # 命中缓存则跳过模型调用
+            cache_key = self._cache_key(user_input, image_path)
+            cached = _RESPONSE_CACHE.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                response, result = cached
+            elif self.structured_llm is not None:
+                output = await self.structured_llm.ainvoke(messages)
+                response, result = output["raw"], self._parse_structured_output(output)
+            elif self.async_client is not None:
+                response = await self._ollama_achat(messages)
+                result = self._parse_response(response)
             else:
-                return {
-                    "success": True,
-                    "response": response.content,
-                    "raw": response.content,
-                    "structured": False
-                }
+                response = await self.llm.ainvoke(messages)
+                result = self._parse_response(response)
+            
+            # 完成后再写回历史
+            return self._record_turn(user_msg, response, result, cache_key)
                 
         except Exception as e:
             return {
@@ -160,97 +396,202 @@ class ChatManager:
                 "response": None
             }
     
-    def save_conversation(self) -> str:
-        """保存对话记录"""
-        data = {
-            "conversation_id": self.conversation_id,
-            "timestamp": datetime.now().isoformat(),
-            "model": f"{self.model_type}:{self.model_name}",
-            "structured_output": self.use_structured,
-            "messages": [
-                {
-                    "type": msg.__class__.__name__,
-                    "content": msg.content,
-                    "timestamp": datetime.now().isoformat()
-                }
-                for msg in self.messages
-            ]
-        }
+    async def _ollama_achat(self, messages: List[Any]) -> AIMessage:
+        """通过 Ollama AsyncClient 生成回复，结果包装为 AIMessage 以便统一写入历史"""
+        payload = []
+        for msg in messages:
+            item = {"role": _OLLAMA_ROLES[msg.type]}
+            if isinstance(msg.content, str):
+                item["content"] = msg.content
+            else:
+                # 多模态消息：文本拼接，图片取 data URI 中的 base64 部分
+                texts, images = [], []
+                for part in msg.content:
+                    if part["type"] == "text":
+                        texts.append(part["text"])
+                    elif part["type"] == "image_url":
+                        images.append(part["image_url"]["url"].partition("base64,")[2])
+                item["content"] = "\n".join(texts)
+                if images:
+                    item["images"] = images
+            payload.append(item)
+        
+        response = await self.async_client.chat(
+            model=self.model_name, messages=payload, options=self._ollama_options
+        )
+        return AIMessage(content=response.message.content)
+    
+    async def batch_ask(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """
+        把互不依赖的问题合并成一次请求（每批最多 _BATCH_MAX 个），减少往返次数。
+        启用缓存时与 achat 相同地先查缓存，只提问未命中的问题。
+        返回与 achat 相同格式的结果列表，顺序、数量与 questions 一致；某批失败时对应位置为错误结果。
+        """
+        # 缓存键按提问前的历史计算，命中的问题在提问结束后再写回历史，保证批量请求的上下文与键一致
+        digest = self._history_digest() if self.enable_cache else None
+        keys = [self._cache_key(q, None, digest) for q in questions]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+        hits, pending = [], []
+        for i, key in enumerate(keys):
+            cached = _RESPONSE_CACHE.get(key) if key is not None else None
+            if cached is not None:
+                hits.append((i, cached))
+            else:
+                pending.append(i)
         
-        file_path = self.save_dir / f"{self.conversation_id}.json"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        chunks = [pending[i:i + _BATCH_MAX] for i in range(0, len(pending), _BATCH_MAX)]
+        chunk_results = await asyncio.gather(
+            *(self._ask_chunk([questions[j] for j in chunk], [keys[j] for j in chunk]) for chunk in chunks),
+            return_exceptions=True
+        )
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, BaseException):
+                logger.error("batch_ask: %d 个问题提问失败: %r", len(chunk), chunk_result)
+                chunk_result = [
+                    {"success": False, "error": str(chunk_result), "response": None} for _ in chunk
+                ]
+            for j, result in zip(chunk, chunk_result):
+                results[j] = result
         
-        return str(file_path)
+        for i, (response, result) in hits:
+            results[i] = self._record_turn(self._build_user_message(questions[i]), response, result, None)
+        return results
+    
+    async def _ask_chunk(self, questions: List[str], keys: List[Optional[Tuple]]) -> List[Dict[str, Any]]:
+        """合并提问一批问题，成功的回答按 keys 写入缓存；模型不支持 json_schema、请求失败或回答数量不符时退回逐个并发提问"""
+        if self._json_schema and len(questions) > 1:
+            if self._batch_llm is None:
+                # 结构化对话按 AnalysisResponse 逐题返回，与 achat 的结果格式一致
+                self._batch_llm = self.llm.with_structured_output(
+                    BatchAnalyses if self.use_structured else BatchAnswers,
+                    method="json_schema", include_raw=True
+                )
+            numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+            user_msg = HumanMessage(
+                content=f"请依次回答以下互不相关的问题，answers 按题号顺序每题一项：\n{numbered}"
+            )
+            try:
+                output = await self._batch_llm.ainvoke(self.messages + [user_msg])
+                parsed = output["parsed"]
+                if parsed is not None and len(parsed.answers) == len(questions):
+                    self._append_history(user_msg, output["raw"])
+                    results = []
+                    for key, answer in zip(keys, parsed.answers):
+                        if self.use_structured:
+                            raw = answer.model_dump_json()
+                            result = {"success": True, "response": answer.model_dump(), "raw": raw, "structured": True}
+                        else:
+                            raw = answer
+                            result = {"success": True, "response": answer, "raw": raw, "structured": False}
+                        self._store_cache(key, AIMessage(content=raw), result)
+                        results.append(dict(result))
+                    return results
+                logger.warning("batch_ask: 合并提问未得到 %d 个回答，改为逐个提问", len(questions))
+            except Exception:
+                logger.exception("batch_ask: 合并提问失败，改为逐个提问")
+        return list(await asyncio.gather(*(self.achat(q) for q in questions)))
+    
+    def save_conversation(self) -> str:
+        """保存对话记录：消息已逐轮追加到日志，这里只需刷新缓冲区（尚未写过则创建文件）"""
+        self._log_file().flush()
+        return str(self.log_path)
+    
+    async def asave_conversation(self) -> str:
+        """异步保存对话记录，刷新操作放到线程中执行"""
+        return await asyncio.to_thread(self.save_conversation)
     
     def clear_history(self):
-        """清空对话历史（保留系统提示）"""
+        """清空对话历史（保留系统提示）；日志保留完整记录"""
         self.messages = [self.messages[0]]
+        if self._log_fh is not None:
+            self._log_fh.flush()
+    
+    def close(self):
+        """关闭对话日志"""
+        if self._log_fh is not None and not self._log_fh.closed:
+            self._log_fh.close()
+    
+    async def aclose(self):
+        """异步关闭对话日志（刷新/关闭放到线程中执行）"""
+        await asyncio.to_thread(self.close)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    def __del__(self):
+        log_fh = getattr(self, "_log_fh", None)
+        if log_fh is not None and not log_fh.closed:
+            log_fh.close()
 
 
-def demo_basic_chat():
+async def demo_basic_chat():
     """基础多轮对话演示"""
     print("=== 基础多轮对话演示 ===")
     
-    chat = ChatManager(
+    async with ChatManager(
         system_prompt="你是一个专业的技术顾问，善于解释复杂概念。",
         model_type="openai",
         model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
         temperature=0.7
-    )
+    ) as chat:
     
-    questions = [
-        "什么是机器学习？",
-        "监督学习和无监督学习有什么区别？",
-        "能举个具体的深度学习应用例子吗？"
-    ]
+        questions = [
+            "什么是机器学习？",
+            "监督学习和无监督学习有什么区别？",
+            "能举个具体的深度学习应用例子吗？"
+        ]
+    
+        # 问题之间互不依赖，合并为一次请求发出
+        results = await chat.batch_ask(questions)
     
-    for i, q in enumerate(questions, 1):
-        print(f"\n问题 {i}: {q}")
-        result = chat.chat(q)
+        for i, (q, result) in enumerate(zip(questions, results), 1):
+            print(f"\n问题 {i}: {q}")
         
-        if result["success"]:
-            print(f"回答: {result['response']}")
-        else:
-            print(f"错误: {result['error']}")
+            if result["success"]:
+                print(f"回答: {result['response']}")
+            else:
+                print(f"错误: {result['error']}")
     
-    file_path = chat.save_conversation()
-    print(f"\n对话已保存: {file_path}")
+        file_path = await chat.asave_conversation()
+        print(f"\n对话已保存: {file_path}")
 
 
-def demo_structured_output():
+async def demo_structured_output():
     """结构化输出演示"""
     print("=== 结构化输出演示 ===")
     
-    chat = ChatManager(
+    async with ChatManager(
         system_prompt="你是一个分析专家，需要提供结构化的分析结果。",
         model_type="openai",
         model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
         use_structured=True,
         temperature=0.5
-    )
+    ) as chat:
     
-    question = "请分析Python编程语言的优缺点"
-    print(f"问题: {question}")
+        question = "请分析Python编程语言的优缺点"
+        print(f"问题: {question}")
     
-    result = chat.chat(question)
+        result = await chat.achat(question)
     
-    if result["success"]:
-        if result["structured"]:
-            print("结构化输出:")
-            print(json.dumps(result["response"], ensure_ascii=False, indent=2))
+        if result["success"]:
+            if result["structured"]:
+                print("结构化输出:")
+                print(json.dumps(result["response"], ensure_ascii=False, indent=2))
+            else:
+                print("原始输出 (结构化解析失败):")
+                print(result["response"])
+                if "parse_error" in result:
+                    print(f"解析错误: {result['parse_error']}")
         else:
-            print("原始输出 (结构化解析失败):")
-            print(result["response"])
-            if "parse_error" in result:
-                print(f"解析错误: {result['parse_error']}")
-    else:
-        print(f"错误: {result['error']}")
+            print(f"错误: {result['error']}")
     
-    chat.save_conversation()
+        await chat.asave_conversation()
 
 
-def demo_multimodal():
+async def demo_multimodal():
     """多模态对话演示"""
     print("=== 多模态对话演示 ===")
     
@@ -261,66 +602,71 @@ def demo_multimodal():
         print("跳过多模态演示")
         return
     
-    chat = ChatManager(
+    async with ChatManager(
         system_prompt="你是一个图像分析专家，能够详细描述图片内容。",
         model_type="openai",
         model_name=os.getenv("OPENAI_MODEL", "gpt-4-vision-preview"),
         use_structured=True,
         temperature=0.3
-    )
-    
-    question = "请分析这张图片的内容，描述你看到了什么"
-    print(f"问题: {question}")
-    print(f"图片: {image_path}")
-    
-    result = chat.chat(question, image_path)
-    
-    if result["success"]:
-        if result["structured"]:
-            print("结构化分析:")
-            response = result["response"]
-            print(f"摘要: {response.get('summary', 'N/A')}")
-            print(f"推理: {response.get('reasoning', 'N/A')}")
-            print(f"置信度: {response.get('confidence', 'N/A')}")
-            print(f"标签: {', '.join(response.get('tags', []))}")
+    ) as chat:
+    
+        question = "请分析这张图片的内容，描述你看到了什么"
+        print(f"问题: {question}")
+        print(f"图片: {image_path}")
+    
+        result = await chat.achat(question, image_path)
+    
+        if result["success"]:
+            if result["structured"]:
+                print("结构化分析:")
+                response = result["response"]
+                print(f"摘要: {response.get('summary', 'N/A')}")
+                print(f"推理: {response.get('reasoning', 'N/A')}")
+                print(f"置信度: {response.get('confidence', 'N/A')}")
+                print(f"标签: {', '.join(response.get('tags', []))}")
+            else:
+                print("图片分析结果:")
+                print(result["response"])
         else:
-            print("图片分析结果:")
-            print(result["response"])
-    else:
-        print(f"错误: {result['error']}")
+            print(f"错误: {result['error']}")
     
-    chat.save_conversation()
+        await chat.asave_conversation()
 
 
-def demo_ollama():
-    """Ollama本地模型演示"""
+async def demo_ollama():
+    """
+    Ollama本地模型演示
+    
+    服务端需设置 OLLAMA_NUM_PARALLEL>1 才能真正并行处理多个请求；
+    OLLAMA_MAX_LOADED_MODELS 控制可同时常驻内存的模型数。
+    """
     print("=== Ollama本地模型演示 ===")
     
     try:
-        chat = ChatManager(
+        async with ChatManager(
             system_prompt="你是一个有帮助的AI助手。",
             model_type="ollama",
             model_name="llama2",  # 或其他已安装的模型
             temperature=0.8
-        )
+        ) as chat:
         
-        question = "简单解释什么是人工智能"
-        print(f"问题: {question}")
+            question = "简单解释什么是人工智能"
+            print(f"问题: {question}")
         
-        result = chat.chat(question)
+            result = await chat.achat(question)
         
-        if result["success"]:
-            print(f"回答: {result['response']}")
-        else:
-            print(f"错误: {result['error']}")
+            if result["success"]:
+                print(f"回答: {result['response']}")
+            else:
+                print(f"错误: {result['error']}")
             
-        chat.save_conversation()
+            await chat.asave_conversation()
         
     except Exception as e:
         print(f"Ollama演示失败 (可能未安装): {e}")
 
 
-def main():
+async def main():
     """主函数"""
     print("LangChain 优化演示程序")
     print("环境: conda infer")
@@ -333,20 +679,17 @@ def main():
         print()
     
     try:
-        # 演示1: 基础多轮对话
-        demo_basic_chat()
-        print("\n" + "="*40)
-        
-        # 演示2: 结构化输出
-        demo_structured_output()
-        print("\n" + "="*40)
-        
-        # 演示3: 多模态对话
-        demo_multimodal()
-        print("\n" + "="*40)
-        
-        # 演示4: Ollama本地模型
-        demo_ollama()
+        # 四个演示互不依赖，并发运行，总耗时约为最慢的一个；单个演示失败不影响其他演示
+        results = await asyncio.gather(
+            demo_basic_chat(),         # 演示1: 基础多轮对话
+            demo_structured_output(),  # 演示2: 结构化输出
+            demo_multimodal(),         # 演示3: 多模态对话
+            demo_ollama(),             # 演示4: Ollama本地模型
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"程序异常: {result}")
         
     except KeyboardInterrupt:
         print("\n程序被用户中断")
@@ -357,4 +700,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
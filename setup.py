@@ -20,6 +20,15 @@ setup(
         "python-dotenv>=1.0.0",
     ],
     extras_require={
+        "fast": [
+            "orjson>=3.8.0",
+        ],
+        "http2": [
+            "httpx[http2]",
+        ],
+        "msgpack": [
+            "msgpack>=1.0.0",
+        ],
         "dev": [
             "pytest>=7.0.0",
             "pytest-asyncio>=0.21.0",